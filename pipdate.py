@@ -12,21 +12,49 @@ Basic use:
 
  * Pipdate must have permissions to installation folders.
 """
+import io
 import os
+import re
 import sys
+import json
+import time
+import zlib
 import ctypes
+import signal
+import hashlib
 import logging
 import argparse
+import threading
 from subprocess import Popen, PIPE
 from string import ascii_uppercase
+from collections import namedtuple, deque
+from multiprocessing.pool import ThreadPool
+try:
+    from http.client import HTTPConnection, HTTPSConnection
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, urljoin
+    from urllib.request import urlopen
+    from queue import Queue
+except ImportError:     # Python 2
+    # noinspection PyUnresolvedReferences
+    from httplib import HTTPConnection, HTTPSConnection
+    # noinspection PyUnresolvedReferences
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    # noinspection PyUnresolvedReferences
+    from SocketServer import ThreadingMixIn
+    # noinspection PyUnresolvedReferences
+    from urlparse import urlsplit, urljoin
+    # noinspection PyUnresolvedReferences
+    from urllib2 import urlopen
+    # noinspection PyUnresolvedReferences
+    from Queue import Queue
 
 __version__ = '1.32'
 __last_updated__ = '19/07/2018'
 __author__ = 'just-another-user'
 
 
-# TODO: - Implement timeout functionality.
-
 # **********************************************************************
 # Set globals
 NIX = True if os.name == 'posix' else False
@@ -34,51 +62,100 @@ NIX = True if os.name == 'posix' else False
 COLOR = '\x1b[{};{}m' if NIX else ''
 BLACK, RED, GREEN, YELLOW, BLUE, PURPLE, CYAN, WHITE = range(30, 38)
 NORMAL, BOLD, UNDERLINED = range(3)
+
+MAX_WORKERS = 8     # Maximum number of python executables queried at the same time.
+
+# Seconds each kind of command may run before its whole process group is killed; None for no limit.
+TIMEOUTS = {'list': 600, 'install': None, 'probe': 30}
+KILL_GRACE = 5      # Seconds between asking a timed out process group to terminate, and killing it.
+OUTPUT_TAIL = 200   # Lines of pip's output kept for reporting errors; Earlier lines are only parsed.
+
+KNOWN_NIX_PATHS = ['/usr/local/bin', '/usr/bin', '/bin']
+PYTHON_NAME = re.compile(r"^python(\d+(\.\d+)?)?$", re.IGNORECASE)     # python, python3, python3.6...
+
+DEFAULT_INDEX_URL = 'https://pypi.org/simple/'
+INDEX_TTL = 600             # Seconds for which a cached index page is used without asking the index again.
+INDEX_CONNECTIONS = 4       # Keep-alive connections kept open to the index.
+INDEX_TIMEOUT = 30          # Seconds to wait for the index to respond.
+INDEX_CACHE_FORMAT = 2      # Version of the index cache's file format.
+PIP_OPTIONS = []            # Extra options passed to every 'pip install' command (e.g. the index to install from).
+
+# Prints a description of the python executable running it as JSON. Must run on Python 2.7 as well.
+PROBE_SCRIPT = """
+import json, platform, site, sys, sysconfig
+info = {
+    'version': platform.python_version(),
+    'implementation': platform.python_implementation(),
+    'python_tag': {'CPython': 'cp', 'PyPy': 'pp'}.get(platform.python_implementation(), 'py') +
+                  '%d%d' % sys.version_info[:2],
+    'abi': sysconfig.get_config_var('SOABI'),
+    'platform': sysconfig.get_platform(),
+    'prefix': sys.prefix,
+    'base_prefix': getattr(sys, 'base_prefix', getattr(sys, 'real_prefix', sys.prefix)),
+}
+info['venv'] = info['prefix'] != info['base_prefix']
+paths = list(getattr(site, 'getsitepackages', list)())
+paths += [site.getusersitepackages()] if getattr(site, 'ENABLE_USER_SITE', False) else []
+info['site_packages'] = paths + [p for p in sys.path if p.endswith(('site-packages', 'dist-packages'))]
+try:
+    import ssl
+    info['ssl'] = True
+except ImportError:
+    info['ssl'] = False
+sys.stdout.write(json.dumps(info))
+"""
 # **********************************************************************
 
 
-def get_nix_paths():        # pragma: no cover
+def find_pythons(dirs):
+    """
+    Find the python executables (python, python3, python3.6...) directly inside some folders.
+    Several names often refer to the same file (e.g. 'python3' linking to 'python3.6'), even across folders.
+    Such duplicates are identified by the device and inode of the file they resolve to, and only the most specific
+    name is kept, favoring earlier folders on ties.
+    :param list dirs: The folders to search.
+    :return list: The unique python executables, sorted.
+    """
+    found = {}
+    for path in dirs:
+        for name, py, is_dir in iter_dir(path):
+            if is_dir or not PYTHON_NAME.match(name):
+                continue
+            try:
+                stat = os.stat(py)  # Follows links, so every name of the same file gets the same key.
+            except OSError:
+                continue            # A broken link.
+            key = (stat.st_dev, stat.st_ino)
+            if key not in found or len(name) > len(os.path.basename(found[key])):
+                found[key] = py
+    return sorted(found.values())
+
+
+def get_nix_paths():
     """
     Find the python executables in *nix systems by searching known installation paths.
+    The result is cached, and reused for as long as none of the searched folders has been modified.
     :return list: All python executables found.
     """
-    def is_float(num):
-        """
-        Check if a string is a float.
-        :param str num: The string to test.
-        :return bool: True if string is a float or empty; False otherwise
-        """
-        try:
-            return True if not num else isinstance(float(num), float)
-        except Exception:
-            return False
-
     # Possible locations for python executables.
-    known_nix_paths = ['/usr/local/bin', '/usr/bin', '/bin'] + get_env_paths()
-
-    py_paths = []
-    for path in known_nix_paths:
-        _, _, files = next(os.walk(path))
-        # Get all files which start with python.
-        py_paths += [os.sep.join([path, _file]) for _file in files
-                     if _file.lower().startswith('python')
-                     and is_float(_file[6:])
-                     and os.path.isfile(os.sep.join([path, _file]))
-                     and os.sep.join([path, _file]) not in py_paths]
-
-    # ***
-    # In *nix systems there might be a couple of files referencing the same files:
-    # e.g. 'python2', 'python2.7', 'python', etc...
-    # In order to avoid these duplicates, only keep the unique names (i.e. 'python2.7' and not the rest).
-
-    #  Iterate over a *copy* of the list so that it could be manipulated as well.
-    py_paths = sorted(list(set(py_paths[::])))
-    for py in py_paths[::]:
-        for _py in py_paths[py_paths.index(py) + 1:]:
-            if not py == _py and py.split(os.sep)[-1] in _py.split(os.sep)[-1]:
-                py_paths.remove(py)
-                break
-
+    known_nix_paths = []
+    for path in KNOWN_NIX_PATHS + get_env_paths():
+        if path not in known_nix_paths and os.path.isdir(path):
+            known_nix_paths.append(path)
+
+    # Adding, removing or re-linking a file in a folder changes the folder's modification time.
+    mtimes = dict((path, os.stat(path).st_mtime) for path in known_nix_paths)
+    cache_file = os.path.join(get_cache_dir(), 'discovery.json')
+    cached = read_json(cache_file, {})
+    if cached.get('dirs') == mtimes and all(os.path.isfile(py) for py in cached.get('pythons', [])):
+        logging.debug("Using cached python executables from {}".format(cache_file))
+        return cached['pythons']
+
+    py_paths = find_pythons(known_nix_paths)
+    try:
+        write_json(cache_file, {'dirs': mtimes, 'pythons': py_paths})
+    except (IOError, OSError) as exp:
+        logging.debug("Unable to cache python executables. {}".format(exp))
     return py_paths
 
 
@@ -143,17 +220,1026 @@ def get_paths():        # pragma: no cover
     # Further os support <should come here>.
 
 
-class Pip(object):          # pragma: no cover
+class Deadline(object):
     """
-    Work in progress.
-    The objective is to make every available python version a class.
-    Upon initialization, the instance will use threads to check for outdated packages.
-    Each Pip instance will update its own outdated packages.
+    A time budget for a whole run.
+    Once the deadline passes no new work is started, commands still running are limited to the remaining time,
+    and whatever was skipped is recorded so it can be reported.
+    """
+
+    def __init__(self, seconds=None):
+        self.end = time.time() + seconds if seconds else None
+        self.skipped = []
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """
+        :return float: Seconds left until the deadline; None if there is no deadline.
+        """
+        return None if self.end is None else max(0.0, self.end - time.time())
+
+    def expired(self):
+        return self.end is not None and time.time() >= self.end
+
+    def timeout(self, timeout):
+        """
+        Limit a command's timeout to the time left until the deadline.
+        :param float timeout: The command's own timeout; None for no limit.
+        :return float: The timeout to use; None for no limit.
+        """
+        remaining = self.remaining()
+        return timeout if remaining is None else remaining if timeout is None else min(timeout, remaining)
+
+    def skip(self, python, what):
+        """
+        Record work which was skipped because the deadline has passed.
+        """
+        with self._lock:
+            self.skipped.append((python, what))
+
+
+DEADLINE = Deadline()   # No deadline unless one is given with --deadline.
+_running = set()        # Processes started by run_command() which haven't finished yet.
+
+
+def kill_process_group(process):
+    """
+    Terminate a process along with every process it has started, and kill them if they don't exit in time.
+    :param Popen process: A process started by run_command().
+    """
+    try:
+        if not getattr(process, 'grouped', False):
+            process.kill()
+            return
+        if not NIX:
+            Popen(['taskkill', '/F', '/T', '/PID', str(process.pid)], stdout=PIPE, stderr=PIPE).communicate()
+            return
+        os.killpg(process.pid, signal.SIGTERM)
+        for _ in range(int(KILL_GRACE * 10)):
+            if process.poll() is not None:
+                return
+            time.sleep(0.1)
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError as exp:
+        logging.debug("Unable to kill process {}. {}".format(process.pid, exp))
+
+
+def kill_running_processes():
+    """
+    Kill every command still running, e.g. when the run is interrupted.
+    """
+    for process in list(_running):
+        kill_process_group(process)
+
+
+def run_command(command, timeout=None, on_line=None, tail=None):
+    """
+    Run a command in a process group of its own, and kill the whole group if it runs for longer than the timeout
+    or than the time left until the run's deadline.
+    Both output streams are read line by line as they arrive, so a chatty command can never fill a pipe and block.
+    :param list command: The command and its arguments.
+    :param float timeout: Seconds to let the command run; None for no limit.
+    :param callable on_line: Called with each line (without its line break) and the name of its stream
+                             ('stdout' or 'stderr'), as soon as it is read.
+    :param int tail: Keep only this many of the last lines of each stream; None to keep everything.
+    :return tuple: (returncode, output, error); returncode is None if the command timed out.
+    """
+    timeout = DEADLINE.timeout(timeout)
+    if timeout is None:
+        # Without a time limit the command stays in this session, so 'sudo' can still ask for a password.
+        group = {}
+    elif NIX:
+        group = {'start_new_session': True} if sys.version_info[0] >= 3 else {'preexec_fn': os.setsid}
+    else:
+        group = {'creationflags': 0x200}    # CREATE_NEW_PROCESS_GROUP
+    process = Popen(command, stdout=PIPE, stderr=PIPE, **group)
+    process.grouped = bool(group)
+    _running.add(process)
+    timed_out = threading.Event()
+    output, error = deque(maxlen=tail), deque(maxlen=tail)
+
+    def expire():
+        logging.debug("Timed out after {:.0f}s: {}".format(timeout, " ".join(command)))
+        timed_out.set()
+        kill_process_group(process)
+
+    def read(stream, lines, name):
+        for line in iter(stream.readline, b''):
+            line = line.decode('utf-8', 'replace')
+            lines.append(line)
+            if on_line is not None:
+                on_line(line.rstrip('\r\n'), name)
+        stream.close()
+
+    timer = threading.Timer(timeout, expire) if timeout is not None else None
+    reader = threading.Thread(target=read, args=(process.stderr, error, 'stderr'))
+    reader.daemon = True
+    try:
+        if timer:
+            timer.daemon = True
+            timer.start()
+        reader.start()
+        read(process.stdout, output, 'stdout')
+        reader.join()
+        process.wait()
+    except KeyboardInterrupt:
+        kill_process_group(process)
+        raise
+    finally:
+        _running.discard(process)
+        if timer:
+            timer.cancel()
+    return None if timed_out.is_set() else process.returncode, ''.join(output), ''.join(error)
+
+
+PipEvent = namedtuple('PipEvent', 'kind name detail')
+
+PIP_STATUS_LINES = [
+    ('collecting', re.compile(r"^\s*Collecting (?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)(?P<detail>.*)")),
+    ('downloading', re.compile(r"^\s*Downloading (?P<name>\S+)(?: \((?P<detail>[\d.]+ ?[kMG]?B)\))?")),
+    ('building', re.compile(r"^\s*Building wheel for (?P<name>\S+)(?P<detail>.*)")),
+    ('satisfied', re.compile(r"^\s*Requirement already (?:satisfied|up-to-date): (?P<name>[A-Za-z0-9._-]+)"
+                             r"(?P<detail>.*)")),
+    ('installed', re.compile(r"^Successfully installed (?P<name>)(?P<detail>.+)")),
+]
+SIZE_UNITS = {'B': 1, 'kB': 1000, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3}
+
+
+def parse_pip_line(line):
+    """
+    Turn one of the status lines pip prints while installing into an event.
+    :param str line: A line of pip's output.
+    :return PipEvent: The event, or None if the line isn't a status line.
+                      'collecting', 'building' and 'satisfied' events name the package,
+                      'downloading' events name the file and carry its size in bytes (None if unknown),
+                      and an 'installed' event carries a {name: version} dict of the installed distributions.
+    """
+    for kind, pattern in PIP_STATUS_LINES:
+        match = pattern.match(line)
+        if not match:
+            continue
+        name, detail = match.group('name'), (match.group('detail') or '').strip()
+        if kind == 'downloading':
+            name = name.rstrip('/').rsplit('/', 1)[-1].split('#', 1)[0]
+            size = re.match(r"([\d.]+) ?([kMG]?B)$", detail)
+            detail = int(float(size.group(1)) * SIZE_UNITS.get(size.group(2), 1)) if size else None
+        elif kind == 'installed':
+            detail = dict(dist.rsplit('-', 1) if '-' in dist else (dist, '') for dist in detail.split())
+        return PipEvent(kind, name, detail)
+    return None
+
+
+class PipOutput(object):
+    """
+    Follows the output of a pip install run as it arrives (see run_command()), turning its status lines into
+    progress events and keeping track of what was installed and downloaded.
+    """
+
+    def __init__(self, python, progress=None):
+        """
+        :param str python: The path to the python executable running pip.
+        :param callable progress: Called with the python executable and each PipEvent as soon as it is parsed.
+        """
+        self.python = python
+        self.progress = progress
+        self.installed = {}         # Canonical package name -> installed version.
+        self.satisfied = set()      # Canonical names of the packages which were already up-to-date.
+        self.downloaded = 0         # Bytes downloaded, as reported by pip.
+
+    def feed(self, line, stream='stdout'):
+        """
+        Handle a line of pip's output.
+        """
+        event = parse_pip_line(line) if stream == 'stdout' else None
+        if event is None:
+            return
+        if event.kind == 'installed':
+            self.installed.update((canonicalize_name(name), version) for name, version in event.detail.items())
+        elif event.kind == 'satisfied':
+            self.satisfied.add(canonicalize_name(event.name))
+        elif event.kind == 'downloading' and event.detail:
+            self.downloaded += event.detail
+        logging.debug("[{}] {} {}".format(self.python, event.kind.capitalize(), event.name or " ".join(
+            "{}-{}".format(name, version) for name, version in sorted(event.detail.items()))))
+        if self.progress is not None:
+            self.progress(self.python, event)
+
+
+class Pip(object):
+    """
+    A python executable and its outdated packages.
+    Instances are handed to a bounded worker pool by scan_outdated(), which checks every executable for outdated
+    packages in the background and hands each instance back as soon as its check is done.
+    Each Pip instance updates its own outdated packages.
     """
 
     def __init__(self, py):
         self.py = py
         self.outdated_packages = []
+        self.outdated = []      # OutdatedPackage records, when the versions are known.
+        self.elapsed = 0.0
+        self.skipped = False    # True if the run's deadline passed before the packages were listed.
+
+    def __repr__(self):
+        return "Pip({!r})".format(self.py)
+
+    def fetch_outdated(self):
+        """
+        Fetch the outdated packages of this python executable.
+        :return Pip: This instance, so it could be used directly as a worker pool's target.
+        """
+        start = time.time()
+        if DEADLINE.expired():
+            self.skipped = True
+            DEADLINE.skip(self.py, 'listing outdated packages')
+        else:
+            self.outdated_packages = list_outdated_packages(self.py)
+        self.elapsed = time.time() - start
+        return self
+
+    def update(self, packages=None, batched=False, jobs=1, progress=None):
+        """
+        Update the outdated packages of this python executable.
+        :param list packages: Names of packages to update instead of the outdated ones.
+        :param bool batched: Install the packages in a single pip run (see install_packages()).
+        :param int jobs: Maximum number of independent groups of packages to update at the same time.
+        :param callable progress: Called with the python executable and each PipEvent of the update.
+        :return bool: True if successfully iterated over all the packages; False otherwise.
+        """
+        return batch_update_packages(self.py, self.outdated_packages if packages is None else packages,
+                                     batched=batched, jobs=jobs, progress=progress)
+
+
+def scan_outdated(pythons, workers=MAX_WORKERS, client=None):
+    """
+    Fetch the outdated packages of several python executables concurrently.
+    Results are yielded as they arrive, so the wall time is bound by the slowest executable rather than
+    by the sum of all of them.
+    :param list pythons: Paths to the python executables.
+    :param int workers: Maximum number of executables to query at the same time.
+    :param IndexClient client: Compare the installed packages against this index directly
+                               (see find_outdated_packages()), instead of running 'pip list -o'.
+    :return generator: Pip instances, in order of completion.
+    """
+    if not pythons:
+        return
+    if client is not None:
+        start = time.time()
+        for py, outdated in find_outdated_packages(pythons, client, workers):
+            pip = Pip(py)
+            pip.outdated = outdated
+            pip.outdated_packages = [package.name.lower() for package in outdated]
+            pip.elapsed = time.time() - start
+            yield pip
+        return
+    pool = ThreadPool(max(1, min(workers, len(pythons))))
+    try:
+        for pip in pool.imap_unordered(Pip.fetch_outdated, [Pip(py) for py in pythons]):
+            yield pip
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+Package = namedtuple('Package', 'name version location')
+
+_probes = {}            # Probe results, keyed as described in probe_python(). Loaded from the cache on first use.
+_probes_lock = threading.Lock()
+
+
+def probe_python(python):
+    """
+    Describe a python executable: its version, implementation, ABI and platform tags, prefix, site-packages folders,
+    pip version, whether it is a virtual environment and whether it supports TLS.
+    The executable is run once, and the result is cached on disk for as long as the executable's inode and
+    modification time don't change. The pip version is read from site-packages every time, as pip gets updated.
+    :param str python: Path to the python executable.
+    :return dict: The description; None if the executable can't be run.
+    """
+    try:
+        stat = os.stat(python)
+    except OSError as exp:
+        logging.debug("[{}] Unable to probe. {}".format(python, exp))
+        return None
+    # A virtual environment's executable is often a link to the base one, so the path is part of the key as well.
+    key = "{}:{}:{}".format(os.path.abspath(python), stat.st_ino, stat.st_mtime)
+
+    with _probes_lock:
+        if not _probes:
+            _probes.update(read_json(os.path.join(get_cache_dir(), 'probes.json'), {}))
+        info = _probes.get(key)
+
+    if info is None:
+        logging.debug("[{}] Probing...".format(python))
+        try:
+            returncode, output, _ = run_command([python, "-c", PROBE_SCRIPT], TIMEOUTS['probe'])
+            if returncode is None:
+                logging.warning("[{}] Timed out while probing; Skipping...".format(python))
+                return None
+            info = json.loads(output)
+        except Exception as exp:
+            logging.debug("[{}] Unable to probe. {}".format(python, exp))
+            return None
+        with _probes_lock:
+            # Forget older probes of the same executable.
+            for old_key in [k for k in _probes if k.rsplit(':', 2)[0] == os.path.abspath(python)]:
+                del _probes[old_key]
+            _probes[key] = info
+            try:
+                write_json(os.path.join(get_cache_dir(), 'probes.json'), _probes)
+            except (IOError, OSError) as exp:
+                logging.debug("Unable to cache probes. {}".format(exp))
+
+    info = dict(info, pip=None, site_packages=[])
+    for path in _probes[key]['site_packages']:
+        if path not in info['site_packages'] and os.path.isdir(path):
+            info['site_packages'].append(path)
+    for site_dir in info['site_packages']:
+        for name, _, _ in iter_dir(site_dir):
+            if name.lower().startswith('pip-') and name.endswith(('.dist-info', '.egg-info')):
+                info['pip'] = name.rsplit('.', 1)[0].split('-')[1]
+        if info['pip']:
+            break
+    return info
+
+
+def probe_pythons(pythons, workers=MAX_WORKERS):
+    """
+    Probe several python executables concurrently.
+    :param list pythons: Paths to the python executables.
+    :param int workers: Maximum number of executables to probe at the same time.
+    :return dict: The result of probe_python() for each executable.
+    """
+    if not pythons:
+        return {}
+    pool = ThreadPool(max(1, min(workers, len(pythons))))
+    try:
+        return dict(zip(pythons, pool.map(probe_python, pythons)))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def usable_pythons(pythons, probes, need_ssl=True):
+    """
+    Filter out python executables which can't be updated, and executables of the same environment.
+    :param list pythons: Paths to the python executables.
+    :param dict probes: The result of probe_python() for each executable.
+    :param bool need_ssl: Skip executables without TLS support, as they can't reach an HTTPS index.
+    :return list: The executables to use.
+    """
+    usable, environments = [], {}
+    for py in pythons:
+        info = probes.get(py)
+        if not info:
+            logging.warning("[{}] Unable to run this python executable; Skipping...".format(py))
+            continue
+        if not info['pip']:
+            logging.warning("[{}] pip isn't installed for this python version; Skipping...".format(py))
+            continue
+        if need_ssl and not info['ssl']:
+            logging.warning("[{}] This python version has no TLS support and can't reach the index; "
+                            "Skipping...".format(py))
+            continue
+        # Different python versions may share a prefix (e.g. /usr), but not their site-packages.
+        environment = (os.path.realpath(info['prefix']), info['version'])
+        if environment in environments:
+            logging.debug("[{}] Same environment as {}; Skipping...".format(py, environments[environment]))
+            continue
+        environments[environment] = py
+        usable.append(py)
+    return usable
+
+
+def get_site_packages(python):
+    """
+    Get the site-packages folders of a python executable, as learned by probe_python().
+    :param str python: Path to the python executable.
+    :return list: Existing site-packages folders, in the order the executable searches them.
+    """
+    return (probe_python(python) or {}).get('site_packages', [])
+
+
+def get_python_version(python):
+    """
+    Get the version of a python executable, as learned by probe_python().
+    :param str python: Path to the python executable.
+    :return str: The version (e.g. '3.6.5'); Empty string if unknown.
+    """
+    return (probe_python(python) or {}).get('version', '')
+
+
+def iter_dir(path):
+    """
+    List a folder's entries without stat-ing each one of them (using os.scandir when available).
+    :param str path: The folder to list.
+    :return generator: (name, path, is_dir) for each entry; Nothing if the folder can't be read.
+    """
+    try:
+        if hasattr(os, 'scandir'):
+            for entry in os.scandir(path):
+                yield entry.name, entry.path, entry.is_dir()
+        else:
+            for name in os.listdir(path):
+                entry_path = os.path.join(path, name)
+                yield name, entry_path, os.path.isdir(entry_path)
+    except OSError as exp:
+        logging.debug("Unable to list {}. {}".format(path, exp))
+
+
+def read_metadata(path, fields=('Name', 'Version')):
+    """
+    Read fields from the headers of a METADATA or PKG-INFO file. Reading stops at the end of the headers.
+    :param str path: Path to the metadata file.
+    :param tuple fields: Names of the fields to read.
+    :return dict: The values found for each field; Fields which appear more than once are collected into a list.
+    """
+    values = {}
+    try:
+        with io.open(path, encoding='utf-8', errors='replace') as metadata:
+            for line in metadata:
+                if not line.strip():
+                    break   # The headers end at the first empty line, and the description follows.
+                field, _, value = line.partition(':')
+                if field in fields:
+                    if field in values:
+                        values[field] = (values[field] if isinstance(values[field], list) else [values[field]])
+                        values[field].append(value.strip())
+                    else:
+                        values[field] = value.strip()
+    except (IOError, OSError) as exp:
+        logging.debug("Unable to read {}. {}".format(path, exp))
+    return values
+
+
+def read_inventory(site_dirs):
+    """
+    Find the packages installed in site-packages folders by reading their *.dist-info and *.egg-info metadata.
+    :param list site_dirs: The site-packages folders, in the order they are searched by the python executable.
+    :return list: A Package for each installed package, sorted by name.
+    """
+    packages = {}
+    for site_dir in site_dirs:
+        for name, path, is_dir in iter_dir(site_dir):
+            if name.endswith('.dist-info'):
+                metadata_file = os.path.join(path, 'METADATA')
+            elif name.endswith('.egg-info'):
+                metadata_file = os.path.join(path, 'PKG-INFO') if is_dir else path
+            else:
+                continue
+            metadata = read_metadata(metadata_file)
+            if not metadata.get('Name') or not metadata.get('Version'):
+                # Fall back on the folder's name, which looks like <name>-<version>.dist-info
+                dist_name, _, dist_version = name.rsplit('.', 1)[0].partition('-')
+                metadata.setdefault('Name', dist_name)
+                metadata.setdefault('Version', dist_version.split('-')[0])
+            key = canonicalize_name(metadata['Name'])
+            if key not in packages:     # A package in an earlier folder shadows the same package in later ones.
+                packages[key] = Package(metadata['Name'], metadata['Version'], path)
+    return [packages[key] for key in sorted(packages)]
+
+
+def list_installed_packages(python):
+    """
+    Get the packages installed for a python executable, without running pip.
+    :param str python: Path to the python executable.
+    :return list: A Package (name, version, location) for each installed package, sorted by name.
+    """
+    return read_inventory(get_site_packages(python))
+
+
+OutdatedPackage = namedtuple('OutdatedPackage', 'name version latest')
+
+VERSION_PATTERN = re.compile(r"""
+    ^v?(?:(?P<epoch>\d+)!)?(?P<release>\d+(?:\.\d+)*)
+    (?:[-_.]?(?P<pre>a|b|c|rc|alpha|beta|pre|preview)[-_.]?(?P<pre_n>\d*))?
+    (?:-(?P<post_n1>\d+)|[-_.]?(?P<post>post|rev|r)[-_.]?(?P<post_n2>\d*))?
+    (?:[-_.]?(?P<dev>dev)[-_.]?(?P<dev_n>\d*))?
+    (?:\+[a-z0-9]+(?:[-_.][a-z0-9]+)*)?$""", re.VERBOSE | re.IGNORECASE)
+PRE_RELEASES = {'a': 0, 'alpha': 0, 'b': 1, 'beta': 1, 'c': 2, 'rc': 2, 'pre': 2, 'preview': 2}
+INFINITY = float('inf')
+SDIST_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.tbz', '.tar.xz', '.txz', '.tar', '.zip')
+
+
+def parse_version(version):
+    """
+    Parse a PEP 440 version into a key which sorts versions in the order pip does.
+    :param str version: A version, e.g. '1.0.post1' or '2.0rc1'.
+    :return tuple: A sortable key; None if the version can't be parsed.
+    """
+    match = VERSION_PATTERN.match(version.strip())
+    if not match:
+        return None
+    release = [int(part) for part in match.group('release').split('.')]
+    while len(release) > 1 and release[-1] == 0:    # 1.0 == 1.0.0
+        release.pop()
+    post = match.group('post_n1') or match.group('post_n2') or ('0' if match.group('post') else None)
+    if match.group('pre'):
+        pre = (PRE_RELEASES[match.group('pre').lower()], int(match.group('pre_n') or 0))
+    elif match.group('dev') and post is None:
+        pre = (-INFINITY, 0)    # 1.0.dev0 comes before 1.0a0
+    else:
+        pre = (INFINITY, 0)
+    return (int(match.group('epoch') or 0), tuple(release), pre,
+            int(post) if post is not None else -INFINITY,
+            int(match.group('dev_n') or 0) if match.group('dev') else INFINITY)
+
+
+def is_prerelease(version):
+    """
+    :param str version: A version.
+    :return bool: True if the version is a pre-release or a development release; False otherwise.
+    """
+    match = VERSION_PATTERN.match(version.strip())
+    return bool(match and (match.group('pre') or match.group('dev')))
+
+
+def version_matches(specifier, version):
+    """
+    Check whether a version satisfies a specifier such as a Requires-Python value ('>=2.7, !=3.0.*').
+    :param str specifier: Comma separated version clauses. Clauses which can't be parsed are ignored.
+    :param str version: The version to check.
+    :return bool: True if the version satisfies every clause; False otherwise.
+    """
+    def has_prefix(prefix):
+        """
+        Check whether the version's release segment starts with the given one, e.g. '3.6.5' starts with '3.6'.
+        """
+        match = VERSION_PATTERN.match(prefix)
+        prefix = [int(part) for part in match.group('release').split('.')] if match else []
+        release = [int(part) for part in VERSION_PATTERN.match(version.strip()).group('release').split('.')]
+        return bool(prefix) and (release + [0] * len(prefix))[:len(prefix)] == prefix
+
+    key = parse_version(version)
+    if key is None:
+        return True
+    for clause in (specifier or '').split(','):
+        match = re.match(r"\s*(~=|===|==|!=|<=|>=|<|>)\s*(\S+)\s*$", clause)
+        if not match:
+            continue
+        operator, target = match.groups()
+        if target.endswith('.*') and operator in ('==', '!='):
+            if has_prefix(target[:-2]) != (operator == '=='):
+                return False
+            continue
+        target_key = parse_version(target)
+        if target_key is None:
+            continue
+        if operator == '~=':
+            # ~=2.2 means >=2.2 and ==2.*
+            if key < target_key or not has_prefix(target.rsplit('.', 1)[0]):
+                return False
+        elif not {'==': key == target_key, '===': version.strip() == target, '!=': key != target_key,
+                  '<=': key <= target_key, '>=': key >= target_key, '<': key < target_key,
+                  '>': key > target_key}[operator]:
+            return False
+    return True
+
+
+def version_from_filename(filename, name):
+    """
+    Get the version of a distribution file from its name.
+    :param str filename: A wheel or sdist file name, e.g. 'requests-2.19.1-py2.py3-none-any.whl'.
+    :param str name: The name of the project the file belongs to.
+    :return str: The version; None if the file isn't a wheel or an sdist of the project.
+    """
+    if filename.endswith('.whl'):
+        parts = filename.split('-')
+        return parts[1] if len(parts) >= 5 and canonicalize_name(parts[0]) == canonicalize_name(name) else None
+    for extension in SDIST_EXTENSIONS:
+        if filename.endswith(extension):
+            stem = filename[:-len(extension)]
+            for index in [i for i, c in enumerate(stem) if c == '-']:
+                if canonicalize_name(stem[:index]) == canonicalize_name(name):
+                    return stem[index + 1:]
+    return None
+
+
+def unescape(text):
+    """
+    Unescape the HTML entities which may appear in attributes of a simple index page.
+    """
+    for entity, char in (('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&#39;', "'"), ('&#x27;', "'"),
+                         ('&amp;', '&')):
+        text = text.replace(entity, char)
+    return text
+
+
+def parse_simple_page(body, content_type, page_url=''):
+    """
+    Parse a project page of a simple index, either in the JSON (PEP 691) or the HTML (PEP 503) format.
+    :param bytes body: The page.
+    :param str content_type: The page's content type.
+    :param str page_url: The page's URL, against which relative file URLs are resolved.
+    :return list: [filename, requires_python, yanked, url, sha256] for each file of the project.
+                  sha256 is None when the index doesn't provide it.
+    """
+    body = body.decode('utf-8', 'replace')
+    if 'json' in content_type:
+        return [[f['filename'], f.get('requires-python'), bool(f.get('yanked')), urljoin(page_url, f.get('url', '')),
+                 f.get('hashes', {}).get('sha256')] for f in json.loads(body).get('files', [])]
+    files = []
+    for attributes, text in re.findall(r"<a\s([^>]*)>([^<]*)</a>", body, re.IGNORECASE):
+        href = re.search(r'href\s*=\s*"([^"]*)"', attributes)
+        requires_python = re.search(r'data-requires-python\s*=\s*"([^"]*)"', attributes)
+        url, _, fragment = unescape(href.group(1) if href else '').partition('#')
+        files.append([unescape(text.strip()), unescape(requires_python.group(1)) if requires_python else None,
+                      'data-yanked' in attributes, urljoin(page_url, url),
+                      fragment[len('sha256='):] if fragment.startswith('sha256=') else None])
+    return files
+
+
+def get_cache_dir(*parts):
+    """
+    Get (and create) a folder in pipdate's cache.
+    The cache is kept in $PIPDATE_CACHE_DIR if set, or in the user's cache folder otherwise.
+    :param parts: Sub-folders to get inside the cache.
+    :return str: Path to the folder.
+    """
+    root = os.environ.get('PIPDATE_CACHE_DIR')
+    if not root:
+        if NIX:
+            root = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'pipdate')
+        else:
+            root = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.expanduser('~'), 'pipdate', 'Cache')
+    path = os.path.join(root, *parts)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass    # Created by another thread in the meantime.
+    return path
+
+
+def read_json(path, default=None):
+    """
+    :return: The contents of a JSON file; default if the file doesn't exist or can't be parsed.
+    """
+    try:
+        with io.open(path, encoding='utf-8') as json_file:
+            return json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    """
+    Write a JSON file atomically, so that readers never see a partially written file.
+    """
+    temp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.current_thread().ident)
+    with open(temp_path, 'w') as json_file:
+        json.dump(data, json_file)
+    if hasattr(os, 'replace'):
+        os.replace(temp_path, path)
+    else:   # Python 2
+        if os.path.exists(path) and not NIX:
+            os.remove(path)
+        os.rename(temp_path, path)
+
+
+class IndexClient(object):
+    """
+    Client of a PEP 503/691 simple index.
+    Requests are sent over a small pool of keep-alive connections which can be shared by several threads.
+    Project pages are cached on disk, and are revalidated (using their ETag or Last-Modified date) once they are
+    older than the TTL.
+    """
+
+    ACCEPT = "application/vnd.pypi.simple.v1+json, application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.01"
+
+    def __init__(self, index_url=DEFAULT_INDEX_URL, connections=INDEX_CONNECTIONS, ttl=INDEX_TTL, cache_dir=None,
+                 timeout=INDEX_TIMEOUT):
+        url = urlsplit(index_url)
+        self.index_url = index_url
+        self.scheme, self.host, self.port = url.scheme, url.hostname, url.port
+        self.path = url.path.rstrip('/') + '/'
+        self.ttl = ttl
+        self.timeout = timeout
+        self.cache_dir = cache_dir or get_cache_dir('index', hashlib.sha1(index_url.encode('utf-8')).hexdigest()[:12])
+        self.stats = {'requests': 0, 'not_modified': 0, 'cache_hits': 0}
+        self._lock = threading.Lock()
+        self._connections = Queue()
+        for _ in range(max(1, connections)):
+            self._connections.put(None)     # Connections are only opened when they are first needed.
+
+    def _connect(self):
+        if self.scheme == 'https':
+            proxy = os.environ.get('https_proxy') or os.environ.get('HTTPS_PROXY')
+            if proxy:
+                proxy = urlsplit(proxy)
+                connection = HTTPSConnection(proxy.hostname, proxy.port, timeout=self.timeout)
+                connection.set_tunnel(self.host, self.port)
+                return connection
+            return HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, path, headers=None):
+        """
+        Send a GET request over one of the pooled connections.
+        A connection which was closed by the server while idle is reopened and the request is sent again.
+        :param str path: The requested path, relative to the index URL (or absolute, if it starts with '/').
+        :param dict headers: Extra request headers.
+        :return tuple: (status, response headers, body)
+        """
+        path = path if path.startswith('/') else self.path + path
+        headers = dict(headers or {}, **{'Accept-Encoding': 'gzip', 'User-Agent': 'pipdate/{}'.format(__version__)})
+        connection = self._connections.get()
+        try:
+            for attempt in range(2):
+                connection = connection or self._connect()
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    body = response.read()
+                    break
+                except Exception:
+                    connection.close()
+                    connection = None
+                    if attempt:
+                        raise
+            with self._lock:
+                self.stats['requests'] += 1
+            response_headers = dict((key.lower(), value) for key, value in response.getheaders())
+            if response_headers.get('content-encoding') == 'gzip':
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            if response_headers.get('connection', '').lower() == 'close':
+                connection.close()
+                connection = None
+            return response.status, response_headers, body
+        finally:
+            self._connections.put(connection)
+
+    def project_url(self, name):
+        """
+        :return str: The URL of a project's page on the index.
+        """
+        return "{}://{}{}{}{}/".format(self.scheme, self.host, ":{}".format(self.port) if self.port else "",
+                                       self.path, canonicalize_name(name))
+
+    def get_project(self, name):
+        """
+        Get the files of a project, from the on-disk cache when it is fresh enough.
+        :param str name: The project's name.
+        :return list: [filename, requires_python, yanked, url, sha256] for each file;
+                      Empty list if the project isn't found.
+        """
+        name = canonicalize_name(name)
+        cache_file = os.path.join(self.cache_dir, name + '.json')
+        cached = read_json(cache_file)
+        if cached and cached.get('format') != INDEX_CACHE_FORMAT:
+            cached = None   # Written by an older version of pipdate.
+        if cached and time.time() - cached.get('fetched', 0) < self.ttl:
+            with self._lock:
+                self.stats['cache_hits'] += 1
+            return cached['files']
+
+        headers = {'Accept': self.ACCEPT}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        try:
+            status, response_headers, body = self.request(name + '/', headers)
+        except Exception as exp:
+            logging.debug("Unable to fetch {} from {}. {}".format(name, self.index_url, exp))
+            return cached['files'] if cached else []
+
+        if status == 304 and cached:
+            with self._lock:
+                self.stats['not_modified'] += 1
+            cached['fetched'] = time.time()
+        elif status == 200:
+            cached = {'etag': response_headers.get('etag'), 'last_modified': response_headers.get('last-modified'),
+                      'fetched': time.time(), 'format': INDEX_CACHE_FORMAT,
+                      'files': parse_simple_page(body, response_headers.get('content-type', ''),
+                                                 self.project_url(name))}
+        elif status == 404:
+            # Remember local-only packages too.
+            cached = {'fetched': time.time(), 'format': INDEX_CACHE_FORMAT, 'files': []}
+        else:
+            logging.debug("Unexpected response from {} for {}: {}".format(self.index_url, name, status))
+            return cached['files'] if cached else []
+        write_json(cache_file, cached)
+        return cached['files']
+
+    def latest_version(self, name, python_version=None, pre=False):
+        """
+        Find the latest version of a project which can be installed.
+        :param str name: The project's name.
+        :param str python_version: Skip versions whose Requires-Python doesn't match this version.
+        :param bool pre: Include pre-releases.
+        :return str: The latest version; None if no version was found.
+        """
+        latest, latest_key = None, None
+        for filename, requires_python, yanked, _, _ in self.get_project(name):
+            version = version_from_filename(filename, name)
+            key = parse_version(version) if version else None
+            if key is None or yanked or (not pre and is_prerelease(version)) or \
+                    (python_version and requires_python and not version_matches(requires_python, python_version)):
+                continue
+            if latest_key is None or key > latest_key:
+                latest, latest_key = version, key
+        return latest
+
+
+def find_outdated_packages(pythons, client=None, workers=MAX_WORKERS):
+    """
+    Find outdated packages without running pip.
+    Installed packages are read from each executable's site-packages, and each package is looked up on the index
+    only once, no matter how many executables have it installed.
+    :param list pythons: Paths to the python executables.
+    :param IndexClient client: Client of the index to compare against.
+    :param int workers: Maximum number of concurrent lookups.
+    :return generator: (python, [OutdatedPackage, ...]) for each executable, as soon as all of its packages are known.
+    """
+    if not pythons:
+        return
+    client = client or IndexClient()
+    pool = ThreadPool(max(1, workers))
+    try:
+        inventories = dict(zip(pythons, pool.map(list_installed_packages, pythons)))
+        versions = dict(zip(pythons, pool.map(get_python_version, pythons)))
+
+        # Each lookup depends on the python version because of Requires-Python, so executables of the same
+        # version share their lookups.
+        lookups, pending = set(), {}
+        for py in pythons:
+            pending[py] = set((canonicalize_name(package.name), versions[py]) for package in inventories[py])
+            lookups.update(pending[py])
+            if not pending[py]:
+                yield py, []
+
+        def lookup(name_and_version):
+            name, python_version = name_and_version
+            return name_and_version, client.latest_version(name, python_version)
+
+        latest = {}
+        for name_and_version, version in pool.imap_unordered(lookup, sorted(lookups)):
+            latest[name_and_version] = version
+            for py in [py for py in pythons if name_and_version in pending[py]]:
+                pending[py].discard(name_and_version)
+                if not pending[py]:
+                    yield py, [OutdatedPackage(package.name, package.version,
+                                               latest[(canonicalize_name(package.name), versions[py])])
+                               for package in inventories[py]
+                               if is_outdated(package.version,
+                                              latest[(canonicalize_name(package.name), versions[py])])]
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def is_outdated(version, latest):
+    """
+    :param str version: The installed version.
+    :param str latest: The latest version available.
+    :return bool: True if the latest version is newer than the installed one; False otherwise.
+    """
+    installed_key = parse_version(version) if version else None
+    latest_key = parse_version(latest) if latest else None
+    return installed_key is not None and latest_key is not None and latest_key > installed_key
+
+
+class IndexProxy(ThreadingMixIn, HTTPServer):
+    """
+    A local caching proxy of a simple index, shared by all the pip processes of a run.
+    Project pages are served from the IndexClient's cache, and distribution files are kept in a content-addressed
+    store (named after their sha256), so each file is downloaded from the upstream index at most once.
+    """
+    daemon_threads = True
+
+    def __init__(self, index_url=DEFAULT_INDEX_URL, ttl=INDEX_TTL, cache_dir=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), IndexProxyHandler)
+        self.client = IndexClient(index_url, ttl=ttl)
+        self.store = cache_dir or get_cache_dir('artifacts')
+        self.url = 'http://127.0.0.1:{}/simple/'.format(self.server_address[1])
+        self.stats = {'pages': 0, 'downloads': 0, 'hits': 0}
+        self._pages = {}        # Project pages served during this run.
+        self._artifacts = {}    # Key of every file listed in a served page -> (upstream URL, sha256)
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logging.debug("Serving {} through {}".format(self.client.index_url, self.url))
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        logging.debug("Index proxy: {pages} pages fetched, {downloads} files downloaded, "
+                      "{hits} files served from the store".format(**self.stats))
+
+    def render_project(self, name):
+        """
+        Render a project's page as PEP 503 HTML, with its files linked to the proxy.
+        :param str name: The project's name.
+        :return str: The page; None if the project isn't found.
+        """
+        name = canonicalize_name(name)
+        with self._lock:
+            files = self._pages.get(name)
+        if files is None:
+            files = self.client.get_project(name)
+            with self._lock:
+                self._pages[name] = files
+                self.stats['pages'] += 1
+        if not files:
+            return None
+
+        links = []
+        for filename, requires_python, yanked, url, sha256 in files:
+            key = sha256 or 'url-' + hashlib.sha256(url.encode('utf-8')).hexdigest()
+            with self._lock:
+                self._artifacts[key] = (url, sha256)
+            links.append('<a href="/files/{}/{}{}"{}{}>{}</a><br/>'.format(
+                key, filename, '#sha256=' + sha256 if sha256 else '',
+                ' data-requires-python="{}"'.format(requires_python.replace('&', '&amp;').replace('<', '&lt;')
+                                                    .replace('>', '&gt;').replace('"', '&quot;'))
+                if requires_python else '', ' data-yanked=""' if yanked else '', filename))
+        return '<!DOCTYPE html>\n<html><head><meta name="pypi:repository-version" content="1.0"></head>' \
+               '<body>\n{}\n</body></html>\n'.format('\n'.join(links))
+
+    def get_artifact(self, key):
+        """
+        Get a distribution file from the store, downloading it from the upstream index if it isn't there yet.
+        Concurrent requests for the same file wait for a single download.
+        :param str key: The file's key, as linked from a project page.
+        :return str: Path to the stored file; None if the file is unknown.
+        """
+        with self._lock:
+            if key not in self._artifacts:
+                return None
+            url, sha256 = self._artifacts[key]
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        path = os.path.join(self.store, key[:2], key)
+        with lock:
+            if os.path.isfile(path):
+                with self._lock:
+                    self.stats['hits'] += 1
+                return path
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            logging.debug("Downloading {}".format(url))
+            digest, temp_path = hashlib.sha256(), "{}.{}.tmp".format(path, os.getpid())
+            response = urlopen(url, timeout=INDEX_TIMEOUT)
+            try:
+                with open(temp_path, 'wb') as artifact:
+                    for chunk in iter(lambda: response.read(1 << 16), b''):
+                        digest.update(chunk)
+                        artifact.write(chunk)
+            finally:
+                response.close()
+            if sha256 and digest.hexdigest() != sha256:
+                os.remove(temp_path)
+                raise ValueError("Hash mismatch for {}".format(url))
+            os.rename(temp_path, path)
+            with self._lock:
+                self.stats['downloads'] += 1
+            return path
+
+
+class IndexProxyHandler(BaseHTTPRequestHandler):
+    """
+    Serves /simple/<project>/ pages and /files/<key>/<filename> files of an IndexProxy.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].split('#')[0].strip('/').split('/')
+        try:
+            if len(parts) == 2 and parts[0] == 'simple':
+                page = self.server.render_project(parts[1])
+                if page is not None:
+                    return self.respond(200, page.encode('utf-8'), 'text/html; charset=utf-8')
+            elif len(parts) == 3 and parts[0] == 'files':
+                path = self.server.get_artifact(parts[1])
+                if path is not None:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(os.path.getsize(path)))
+                    self.end_headers()
+                    with open(path, 'rb') as artifact:
+                        for chunk in iter(lambda: artifact.read(1 << 16), b''):
+                            self.wfile.write(chunk)
+                    return
+            self.respond(404, b'Not found', 'text/plain')
+        except Exception as exp:
+            logging.debug("Index proxy failed to serve {}. {}".format(self.path, exp))
+            self.respond(502, str(exp).encode('utf-8'), 'text/plain')
+
+    def respond(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, msg_format, *args):
+        logging.debug("Index proxy: " + msg_format % args)
 
 
 def list_outdated_packages(python):
@@ -165,44 +1251,52 @@ def list_outdated_packages(python):
     # Run the command and put output in tmp_packs
     logging.debug("[{0}] Running {0} -m pip list -o".format(python))
     try:
-        outdated_packages = Popen([python, "-m", "pip", "list", "-o"], stdout=PIPE, stderr=PIPE).communicate()[0]
+        returncode, outdated_packages, _ = run_command([python, "-m", "pip", "list", "-o"], TIMEOUTS['list'])
     except KeyboardInterrupt:
         logging.warning("[{}] Keyboard interrupt detected; Skipping this version...".format(python))
         return []
     except Exception as exp:
         logging.error("[{}] Exception encountered while listing outdated packages. {}".format(python, exp))
         return []
+    if returncode is None:
+        logging.error("[{}] Timed out while listing outdated packages.".format(python))
+        return []
 
     # Outdated packages come in the form of <package_name> <version>\n
     # So it is first split by newlines and then only the package name is used
     packs = []
     if outdated_packages:
         # noinspection PyTypeChecker
-        packs = [pkg.split()[0].lower() for pkg in outdated_packages.decode('utf-8').split('\n')[2:]
+        packs = [pkg.split()[0].lower() for pkg in outdated_packages.split('\n')[2:]
                  if pkg.split() and pkg.split()[0]]
 
     return packs
 
 
-def update_package(python, package):
+def update_package(python, package, progress=None):
     """
     Update a package
     :param str python: The path to the python executable
     :param str package: Name of the package to update
+    :param callable progress: Called with the python executable and each PipEvent of the update (see PipOutput).
     :return int: 0 package updated successfully
                  1 package is already up to date
                  2 unknown error
                  3 insufficient permissions
                  4 ctrl+c detected
                  5 packge not found
+                 6 timed out
+                 7 skipped, as the run's deadline has passed
     """
-    update_command = [python, "-m", "pip", "install", "-U", package]
+    if DEADLINE.expired():
+        return 7
+    update_command = [python, "-m", "pip", "install"] + PIP_OPTIONS + ["-U", package]
 
     if NIX:  # Add 'sudo -i' if running on a *nix system.
         update_command = ['sudo', '-i'] + update_command
+    pip_output = PipOutput(python, progress)
     try:
-        update_process = Popen(update_command, stdout=PIPE, stderr=PIPE)
-        update_process.wait()
+        returncode, output, error = run_command(update_command, TIMEOUTS['install'], pip_output.feed, OUTPUT_TAIL)
     except KeyboardInterrupt:
         logging.warning("[{}] Keyboard interrupt detected; Skipping {}...".format(python, package))
         return 4
@@ -210,15 +1304,17 @@ def update_package(python, package):
         logging.error("[{}] An exception was raised while updating {}. {}".format(python, package, exp))
         return 2
 
-    output, error = tuple(op.decode('utf-8') for op in update_process.communicate())  # Read process' output
-    if "Successfully installed " + package in output:
+    if returncode is None:
+        logging.debug("[{}] Timed out while updating {}".format(python, package))
+        return 6
+    if canonicalize_name(package) in pip_output.installed:
         logging.debug("[{}] Successfully updated {}".format(python, package))
         return 0
     elif "No matching distribution" in error:
         logging.debug("[{}] No match found for {}".format(python, package))
         return 5    # Package not found
     elif "Inappropriate ioctl for device" in error:
-        if "Requirement already satisfied" in output:
+        if canonicalize_name(package) in pip_output.satisfied:
             logging.debug("[{}] {} is already up-to-date".format(python, package))
             return 1
         logging.debug("[{}] Unable to update {} - update must be manual".format(python, package))
@@ -230,11 +1326,206 @@ def update_package(python, package):
     return 2
 
 
-def batch_update_packages(python, pkg_list):
+def canonicalize_name(name):
+    """
+    Normalize a package name as described in PEP 503, so that e.g. 'Foo_Bar' and 'foo-bar' are the same package.
+    :param str name: A package name.
+    :return str: The normalized name.
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def install_packages(python, packages, progress=None):
+    """
+    Update several packages in a single pip run, so the resolver and the index are only consulted once.
+    pip doesn't install anything when a batch fails, so a failed batch is split in half and each half is retried,
+    until the packages which fail on their own are found. Single packages are handed to update_package().
+    :param str python: The path to the python executable.
+    :param list packages: Names of packages to update.
+    :param callable progress: Called with the python executable and each PipEvent of the update (see PipOutput).
+    :return dict: The outcome of each package, using the same codes as update_package().
+    """
+    if not packages:
+        return {}
+    if DEADLINE.expired():
+        return dict((pkg, 7) for pkg in packages)
+    if len(packages) == 1:
+        return {packages[0]: update_package(python, packages[0], progress)}
+
+    update_command = [python, "-m", "pip", "install"] + PIP_OPTIONS + ["-U"] + list(packages)
+    if NIX:  # Add 'sudo -i' if running on a *nix system.
+        update_command = ['sudo', '-i'] + update_command
+    logging.debug("[{}] Running {}".format(python, " ".join(update_command)))
+    pip_output = PipOutput(python, progress)
+    try:
+        returncode, output, error = run_command(update_command, TIMEOUTS['install'], pip_output.feed, OUTPUT_TAIL)
+    except KeyboardInterrupt:
+        logging.warning("[{}] Keyboard interrupt detected; Skipping {}...".format(python, " ".join(packages)))
+        return dict((pkg, 4) for pkg in packages)
+    except Exception as exp:
+        logging.error("[{}] An exception was raised while updating {}. {}".format(python, " ".join(packages), exp))
+        return dict((pkg, 2) for pkg in packages)
+
+    if returncode is None:
+        # Splitting a batch which ran out of time would only take longer.
+        logging.debug("[{}] Timed out while updating {}".format(python, " ".join(packages)))
+        return dict((pkg, 6) for pkg in packages)
+
+    if returncode == 0:
+        # The last line of a successful run looks like 'Successfully installed pkg1-1.0 pkg2-2.0'.
+        return dict((pkg, 0 if canonicalize_name(pkg) in pip_output.installed else 1) for pkg in packages)
+
+    if "Permission denied" in error or "[Errno 13]" in error:
+        logging.debug("[{}] Insufficient permissions to update {}".format(python, " ".join(packages)))
+        return dict((pkg, 3) for pkg in packages)
+
+    logging.debug("[{}] Batch of {} packages failed; Splitting it in half...".format(python, len(packages)))
+    middle = len(packages) // 2
+    results = install_packages(python, packages[:middle], progress)
+    results.update(install_packages(python, packages[middle:], progress))
+    return results
+
+
+def report_update(python, pkg, updated, exception_raised='N/A'):
+    """
+    Log the outcome of a package update.
+    :param str python: The path to the python executable.
+    :param str pkg: Name of the updated package.
+    :param int updated: The outcome code returned by update_package(); -1 for an exception, -2 for ctrl+c.
+    :param str exception_raised: The exception raised while updating, if any.
+    :return bool: False if the rest of the update should be aborted; True otherwise.
+    """
+    if updated == 0:
+        logging.info("[{}] {}{}{} updated {}successfully.".format(
+            python, COLOR.format(BOLD, PURPLE), pkg, COLOR.format(NORMAL, WHITE), COLOR.format(NORMAL, GREEN)))
+    elif updated == 1:
+        logging.info("[{}] {}{}{} {}already up-to-date.".format(
+            python, COLOR.format(BOLD, PURPLE), pkg, COLOR.format(NORMAL, WHITE), COLOR.format(NORMAL, YELLOW)))
+    elif updated == 2:
+        logging.error("[{}] {}An error was encountered while trying to update {}{}{}.".format(
+            python, COLOR.format(NORMAL, RED), COLOR.format(BOLD, PURPLE), pkg, COLOR.format(NORMAL, RED)))
+    elif updated == 3:
+        logging.error("[{}] {}Insufficient permissions to update package".format(
+            python, COLOR.format(NORMAL, RED)))
+        return False
+    elif updated == 4:
+        # Warning already printed inside update_package().
+        pass
+    elif updated == 5:
+        logging.error("[{}] {}Cannot find a match for {}".format(
+            python, COLOR.format(NORMAL, RED), pkg))
+    elif updated == 6:
+        logging.error("[{}] {}Timed out while updating {}{}{}.".format(
+            python, COLOR.format(NORMAL, RED), COLOR.format(BOLD, PURPLE), pkg, COLOR.format(NORMAL, RED)))
+    elif updated == 7:
+        logging.warning("[{}] {}Deadline reached; Skipping {}".format(python, COLOR.format(NORMAL, YELLOW), pkg))
+        DEADLINE.skip(python, pkg)
+    elif updated == -1:
+        logging.error("[{}] {}An exception was raised: {}".format(
+            python, COLOR.format(NORMAL, RED), exception_raised))
+    elif updated == -2:
+        logging.error("[{}] {}Keyboard interrupt detected. Skipping package {}{}".format(
+            python, COLOR.format(NORMAL, RED), exception_raised, COLOR.format(NORMAL, PURPLE), pkg))
+    else:
+        logging.error("[{}] {}Something went wrong while updating {}.".format(
+            python, COLOR.format(BOLD, RED), pkg, python))
+        return False
+    return True
+
+
+def read_requirements(location):
+    """
+    Get the names of the packages a package requires, as listed in its installed metadata (Requires-Dist).
+    Requirements which only apply to extras are left out.
+    :param str location: The package's *.dist-info or *.egg-info path (see Package).
+    :return list: Canonical names of the required packages.
+    """
+    requirements = []
+    if location.endswith('.dist-info'):
+        requirements = read_metadata(os.path.join(location, 'METADATA'), ('Requires-Dist',)).get('Requires-Dist', [])
+        requirements = requirements if isinstance(requirements, list) else [requirements]
+    elif os.path.isdir(location):
+        # An egg's requires.txt lists the base requirements first, and then the requirements of each [extra].
+        try:
+            with io.open(os.path.join(location, 'requires.txt'), encoding='utf-8', errors='replace') as requires:
+                for line in requires:
+                    if line.startswith('['):
+                        break
+                    requirements.append(line)
+        except (IOError, OSError):
+            pass
+    names = []
+    for requirement in requirements:
+        name = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)", requirement)
+        if name and not re.search(r"\bextra\s*==", requirement.partition(';')[2]):
+            names.append(canonicalize_name(name.group(1)))
+    return names
+
+
+def plan_update_order(python, packages):
+    """
+    Group packages according to their dependencies on each other, as listed in their installed metadata.
+    Groups share no dependencies, so they can be updated independently of each other. Each group is split
+    into layers, where a layer only depends on earlier layers, so updating layer by layer updates dependencies before
+    the packages which depend on them. pip always gets a group of its own, first.
+    :param str python: The path to the python executable.
+    :param list packages: Names of packages to update.
+    :return list: The groups, each a list of layers, each a list of package names in their original order.
+    """
+    names = {}
+    for pkg in packages:
+        names.setdefault(canonicalize_name(pkg), pkg)
+    order = sorted(names, key=lambda key: packages.index(names[key]))
+
+    groups = []
+    if 'pip' in names:
+        groups.append([[names['pip']]])
+        order.remove('pip')
+    if len(order) < 2:
+        return groups + [[[names[key]]] for key in order]
+
+    installed = dict((canonicalize_name(package.name), package) for package in list_installed_packages(python))
+    depends = dict((key, set(read_requirements(installed[key].location)) & set(order) - set([key])
+                    if key in installed else set()) for key in order)
+    neighbors = dict((key, set(depends[key])) for key in order)
+    for key in order:
+        for dependency in depends[key]:
+            neighbors[dependency].add(key)
+
+    grouped = set()
+    for key in order:
+        if key in grouped:
+            continue
+        # Collect every package connected to this one, in either direction.
+        members, pending = set([key]), [key]
+        while pending:
+            for neighbor in neighbors[pending.pop()] - members:
+                members.add(neighbor)
+                pending.append(neighbor)
+        grouped.update(members)
+
+        layers, remaining = [], [member for member in order if member in members]
+        while remaining:
+            layer = [member for member in remaining if not depends[member] & set(remaining)]
+            layer = layer or remaining  # Dependency cycle; Update the rest together.
+            layers.append([names[member] for member in layer])
+            remaining = [member for member in remaining if member not in layer]
+        groups.append(layers)
+    return groups
+
+
+def batch_update_packages(python, pkg_list, batched=False, jobs=1, progress=None):
     """
     Update one or more packages.
+    Packages are updated in dependency order, and independent groups of packages are updated concurrently when
+    jobs > 1 (see plan_update_order()).
     :param str python: The path to the python executable.
     :param list pkg_list: Names of packages to update.
+    :param bool batched: Install each group of packages in a single pip run (see install_packages()),
+                         instead of running pip once per package.
+    :param int jobs: Maximum number of groups of packages to update at the same time.
+    :param callable progress: Called with the python executable and each PipEvent of the update, as pip runs
+                              (see PipOutput).
     :return bool: True if successfully iterated over all the packages; False otherwise.
     """
     logging.info("[{}]".format(python))
@@ -243,46 +1534,71 @@ def batch_update_packages(python, pkg_list):
                                                                              if len(pkg_list) > 1 else '',
                                                                              "s" if len(pkg_list) > 1 else "",
                                                                              " ".join(pkg_list)))
-    for pkg in pkg_list:
-        logging.info("[{}] Updating {}".format(python, pkg))
-        exception_raised = 'N/A'
-        try:
-            updated = update_package(python, pkg)
-        except KeyboardInterrupt:
-            updated = -2
-        except Exception as e:
-            updated = -1
-            exception_raised = str(e)
-        if updated == 0:
-            logging.info("[{}] {}{}{} updated {}successfully.".format(
-                python, COLOR.format(BOLD, PURPLE), pkg, COLOR.format(NORMAL, WHITE), COLOR.format(NORMAL, GREEN)))
-        elif updated == 1:
-            logging.info("[{}] {}{}{} {}already up-to-date.".format(
-                python, COLOR.format(BOLD, PURPLE), pkg, COLOR.format(NORMAL, WHITE), COLOR.format(NORMAL, YELLOW)))
-        elif updated == 2:
-            logging.error("[{}] {}An error was encountered while trying to update {}{}{}.".format(
-                python, COLOR.format(NORMAL, RED), COLOR.format(BOLD, PURPLE), pkg, COLOR.format(NORMAL, RED)))
-        elif updated == 3:
-            logging.error("[{}] {}Insufficient permissions to update package".format(
-                python, COLOR.format(NORMAL, RED)))
-            return False
-        elif updated == 4:
-            # Warning already printed inside update_package().
-            pass
-        elif updated == 5:
-            logging.error("[{}] {}Cannot find a match for {}".format(
-                python, COLOR.format(NORMAL, RED), pkg))
-        elif updated == -1:
-            logging.error("[{}] {}An exception was raised: {}".format(
-                python, COLOR.format(NORMAL, RED), exception_raised))
-        elif updated == -2:
-            logging.error("[{}] {}Keyboard interrupt detected. Skipping package {}{}".format(
-                python, COLOR.format(NORMAL, RED), exception_raised, COLOR.format(NORMAL, PURPLE), pkg))
-        else:
-            logging.error("[{}] {}Something went wrong while updating {}.".format(
-                python, COLOR.format(BOLD, RED), pkg, python))
+    abort = threading.Event()
+
+    def update_group(group):
+        """
+        Update a group of packages, layer by layer.
+        :return bool: False if the update should be aborted; True otherwise.
+        """
+        if batched:
+            # pip resolves the order within a batch on its own.
+            batch = [pkg for layer in group for pkg in layer]
+            if len(batch) > 1:
+                logging.info("[{}] Updating {} in a single batch".format(python, " ".join(batch)))
+            exception_raised = 'N/A'
+            try:
+                results = install_packages(python, batch, progress)
+            except KeyboardInterrupt:
+                results = dict((pkg, -2) for pkg in batch)
+            except Exception as e:
+                results = dict((pkg, -1) for pkg in batch)
+                exception_raised = str(e)
+            for pkg in batch:
+                if not report_update(python, pkg, results.get(pkg, 2), exception_raised):
+                    abort.set()
+                    return False
+            return True
+
+        for pkg in [pkg for layer in group for pkg in layer]:
+            if abort.is_set():
+                return False
+            logging.info("[{}] Updating {}".format(python, pkg))
+            exception_raised = 'N/A'
+            try:
+                updated = update_package(python, pkg, progress)
+            except KeyboardInterrupt:
+                updated = -2
+            except Exception as e:
+                updated = -1
+                exception_raised = str(e)
+            if not report_update(python, pkg, updated, exception_raised):
+                abort.set()
+                return False
+        return True
+
+    groups = plan_update_order(python, pkg_list)
+    if groups and groups[0] == [['pip']] and len(groups) > 1:
+        # Update pip on its own first, so the rest will be installed using the newer version.
+        if not update_group(groups.pop(0)):
             return False
-    return True
+    if jobs <= 1 or len(groups) < 2:
+        if batched and groups:
+            groups = [[[pkg for group in groups for layer in group for pkg in layer]]]
+        for group in groups:
+            if not update_group(group):
+                return False
+        return True
+
+    pool = ThreadPool(min(jobs, len(groups)))
+    try:
+        return all(pool.map(update_group, groups))
+    except KeyboardInterrupt:
+        abort.set()
+        return False
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def running_elevated():
@@ -311,6 +1627,10 @@ def create_argparser():     # pragma: no cover
                         help="Only show the available python installations on the system. "
                              "This option does not require elevated permission.")
 
+    parser.add_argument("-l", "--list-installed", action="store_true",
+                        help="Only show the packages installed for each python version, "
+                             "read directly from their site-packages folders.")
+
     parser.add_argument("-p", "--packages", metavar="PKG", nargs='+', action="store", type=str,
                         help="Packages to specifically update or install (at least one). "
                              "The same as running 'pip install -U <package>'")
@@ -325,6 +1645,51 @@ def create_argparser():     # pragma: no cover
                         action="store", type=str.lower, default=[],
                         help="Update all out-of-date packages, except for these ones (at least one).")
 
+    parser.add_argument("-w", "--workers", metavar="N", action="store", type=int, default=MAX_WORKERS,
+                        help="Check up to N python versions for outdated packages at the same time "
+                             "(default: {}).".format(MAX_WORKERS))
+
+    parser.add_argument("-n", "--native", action="store_true",
+                        help="Find outdated packages by reading the installed packages directly and comparing them "
+                             "against the index, instead of running 'pip list -o' for each python version. "
+                             "Each package is looked up once, and index pages are cached between runs.")
+
+    parser.add_argument("--index-url", metavar="URL", dest="index_url", action="store", type=str,
+                        help="Base URL of the package index (PEP 503) to check and install from "
+                             "(default: {}).".format(DEFAULT_INDEX_URL))
+
+    parser.add_argument("--proxy", action="store_true",
+                        help="Run a local caching proxy of the index for the duration of the run, and install "
+                             "through it, so files needed by several python versions are downloaded only once.")
+
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="Update all the packages of each python version in a single pip run. "
+                             "When a batch fails, it is split until the failing packages are found.")
+
+    parser.add_argument("-J", "--jobs", metavar="N", action="store", type=int, default=1,
+                        help="Update up to N groups of packages of the same python version at the same time. "
+                             "Packages are grouped by their dependencies, so groups never share a package "
+                             "(default: 1).")
+
+    parser.add_argument("--list-timeout", metavar="SEC", dest="list_timeout", action="store", type=float,
+                        default=TIMEOUTS['list'],
+                        help="Stop listing the outdated packages of a python version after SEC seconds "
+                             "(default: {}; 0 for no limit).".format(TIMEOUTS['list']))
+
+    parser.add_argument("--install-timeout", metavar="SEC", dest="install_timeout", action="store", type=float,
+                        default=0,
+                        help="Stop each pip install after SEC seconds (default: no limit). Commands with a limit "
+                             "run in a session of their own, so 'sudo' can't ask for a password.")
+
+    parser.add_argument("--probe-timeout", metavar="SEC", dest="probe_timeout", action="store", type=float,
+                        default=TIMEOUTS['probe'],
+                        help="Give up on a python executable which takes longer than SEC seconds to start "
+                             "(default: {}; 0 for no limit).".format(TIMEOUTS['probe']))
+
+    parser.add_argument("--deadline", metavar="SEC", action="store", type=float,
+                        help="Finish the whole run within SEC seconds. Once the deadline passes no further "
+                             "updates are started, and whatever was skipped is reported.")
+
     return parser.parse_args()
 
 
@@ -334,10 +1699,14 @@ def pipdate():
     Update packages according to arguments.
     :return int: 0 if successful; 1 otherwise.
     """
+    global PIP_OPTIONS, DEADLINE
     arguments = create_argparser()
     logging.basicConfig(
         format="{}%(message)s".format(COLOR.format(NORMAL, WHITE)),
         level=logging.DEBUG if arguments.verbosity else logging.INFO)
+    TIMEOUTS.update(list=arguments.list_timeout or None, install=arguments.install_timeout or None,
+                    probe=arguments.probe_timeout or None)
+    DEADLINE = Deadline(arguments.deadline)
 
     logging.info("pipdate v{}".format(__version__))
     logging.info("")
@@ -355,9 +1724,13 @@ def pipdate():
     if not arguments.just_these:
         if arguments.display_versions:
             if pythons:
+                probes = probe_pythons(pythons, max(1, arguments.workers))
                 logging.info("Found the following unique python versions:")
                 for py in pythons:
-                    logging.info("\t{}".format(py))
+                    info = probes.get(py)
+                    logging.info("\t{}{}".format(py, " ({} {}{}{})".format(
+                        info['implementation'], info['version'], ", venv" if info['venv'] else "",
+                        ", pip {}".format(info['pip']) if info['pip'] else ", no pip") if info else ""))
                 return 0
             else:
                 logging.warning("Could not find any python executables in the system. Aborting...")
@@ -366,6 +1739,23 @@ def pipdate():
         if arguments.extra_execs:
             pythons.extend([py for py in arguments.extra_execs if os.path.isfile(py)])
 
+    if arguments.list_installed:
+        for py in pythons:
+            installed = list_installed_packages(py)
+            logging.info("[{}{}] {}{} installed package{}:".format(
+                COLOR.format(NORMAL, PURPLE), py, COLOR.format(NORMAL, WHITE), len(installed),
+                "" if len(installed) == 1 else "s"))
+            for package in installed:
+                logging.info("\t{} {}".format(package.name, package.version))
+        return 0
+
+    # Skip executables which can't be updated, or which share an environment with another executable.
+    need_ssl = not (arguments.index_url or DEFAULT_INDEX_URL).startswith('http:')
+    pythons = usable_pythons(pythons, probe_pythons(pythons, max(1, arguments.workers)), need_ssl)
+    if not pythons:
+        logging.warning("{}None of the python executables can be updated.".format(COLOR.format(BOLD, RED)))
+        return 1
+
     # if not running_elevated():
     #     logging.critical("pipdate can only {}run with elevated permissions{}.".format(
     #         COLOR.format(BOLD, RED), COLOR.format(NORMAL, WHITE)))
@@ -378,14 +1768,51 @@ def pipdate():
     # User specified packages for update.
     packages = list(arguments.packages) if arguments.packages else []
 
-    for current_py in pythons:
+    PIP_OPTIONS = ['--index-url', arguments.index_url] if arguments.index_url else []
+    proxy = IndexProxy(arguments.index_url or DEFAULT_INDEX_URL).start() if arguments.proxy else None
+    if proxy:
+        PIP_OPTIONS = ['--index-url', proxy.url]
+    client = None
+    if arguments.native and not packages:
+        client = proxy.client if proxy else IndexClient(arguments.index_url or DEFAULT_INDEX_URL)
+    try:
+        return update_pythons(pythons, packages, arguments, client)
+    except KeyboardInterrupt:
+        kill_running_processes()
+        raise
+    finally:
+        if proxy:
+            proxy.stop()
 
-        # If there are no specific packages to update - get a list of outdated packages.
+
+def update_pythons(pythons, packages, arguments, client=None):
+    """
+    Update the packages of each python executable.
+    :param list pythons: Paths to the python executables.
+    :param list packages: Names of packages to update; The outdated packages of each executable if empty.
+    :param argparse.Namespace arguments: The parsed command line arguments.
+    :param IndexClient client: Find outdated packages using this index client instead of 'pip list -o'.
+    :return int: 0 if successful; 1 otherwise.
+    """
+    if packages:
+        scanned = [Pip(py) for py in pythons]
+    else:
+        # Check all python versions at once, and handle each one as soon as its outdated packages are known.
+        logging.debug("")
+        logging.info("Retrieving outdated packages for {} python version{}...".format(
+            len(pythons), "s" if len(pythons) > 1 else ""))
+        scanned = scan_outdated(pythons, max(1, arguments.workers), client)
+
+    for pip in scanned:
+        current_py = pip.py
+        if pip.skipped:
+            continue    # Already recorded by the deadline.
         if not packages:
             logging.debug("")
-            logging.info("[{}{}] {}Retrieving outdated packages...".format(
-                COLOR.format(NORMAL, PURPLE), current_py, COLOR.format(NORMAL, WHITE)))
-        packages_to_update = packages if packages else list_outdated_packages(current_py)
+            logging.info("[{}{}] {}Found {} outdated package{} in {:.1f}s".format(
+                COLOR.format(NORMAL, PURPLE), current_py, COLOR.format(NORMAL, WHITE), len(pip.outdated_packages),
+                "" if len(pip.outdated_packages) == 1 else "s", pip.elapsed))
+        packages_to_update = packages if packages else pip.outdated_packages
         if not packages_to_update:
             logging.info("[{}{}] {}No outdated packages found!".format(
                 COLOR.format(NORMAL, PURPLE), current_py, COLOR.format(NORMAL, YELLOW)))
@@ -399,11 +1826,20 @@ def pipdate():
                 packages_to_update.insert(0, 'pip')
 
             # Update all requested packages.
-            successfully_iterated_over_everything = batch_update_packages(current_py, packages_to_update)
+            successfully_iterated_over_everything = pip.update(packages_to_update, batched=arguments.batch,
+                                                               jobs=max(1, arguments.jobs))
             if not successfully_iterated_over_everything:
                 logging.error("Update aborted...")
                 return 1  # Abort and exit.
 
+    if client is not None:
+        logging.debug("Index: {requests} requests, {not_modified} not modified, {cache_hits} cache hits".format(
+            **client.stats))
+    if DEADLINE.skipped:
+        logging.warning("{}Deadline reached; Skipped:".format(COLOR.format(BOLD, YELLOW)))
+        for py, what in DEADLINE.skipped:
+            logging.warning("\t[{}] {}".format(py, what))
+        return 1
     logging.info("Done! :)")
     return 0
 
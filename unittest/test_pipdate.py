@@ -2,8 +2,25 @@
 Unittesting for pipdate.py
 """
 
+import io
 import mock
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
 from pipdate import *
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.request import urlopen
+except ImportError:     # Python 2
+    # noinspection PyUnresolvedReferences
+    from urllib2 import urlopen
+    # noinspection PyUnresolvedReferences
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    # noinspection PyUnresolvedReferences
+    from SocketServer import ThreadingMixIn
 import unittest2 as unittest
 import pytest
 
@@ -313,9 +330,13 @@ class PipdateTestSuite(unittest.TestCase):
         # noinspection PyAttributeOutsideInit
         self.original_state = pipdate.__globals__["COLOR"]
         pipdate.__globals__["COLOR"] = ""
+        # noinspection PyAttributeOutsideInit
+        self.original_limits = pipdate.__globals__["DEADLINE"], dict(pipdate.__globals__["TIMEOUTS"])
 
     def tearDown(self):
         pipdate.__globals__["COLOR"] = self.original_state
+        pipdate.__globals__["DEADLINE"] = self.original_limits[0]
+        pipdate.__globals__["TIMEOUTS"].update(self.original_limits[1])
 
     @mock.patch('pipdate.create_argparser')
     @mock.patch('pipdate.logging')
@@ -412,5 +433,652 @@ class PipdateTestSuite(unittest.TestCase):
         mock_log.info.assert_any_call('[pip] No outdated packages found!')
 
 
+# noinspection PyPep8Naming
+class ScanOutdatedTestSuite(unittest.TestCase):
+    """
+    scan_outdated hands a Pip instance per python executable to a worker pool, and yields each instance
+    as soon as its outdated packages are known.
+    """
+
+    @mock.patch('pipdate.list_outdated_packages')
+    def test_fetch_outdated_populates_outdated_packages(self, mock_lop):
+        """
+        Test that a Pip instance stores the outdated packages of its own executable.
+        """
+        mock_lop.return_value = ['pkg1', 'pkg2']
+        pip = Pip('python')
+        self.assertIs(pip, pip.fetch_outdated())
+        self.assertEqual(['pkg1', 'pkg2'], pip.outdated_packages)
+        mock_lop.assert_called_once_with('python')
+
+    @mock.patch('pipdate.list_outdated_packages')
+    def test_every_python_is_yielded_once(self, mock_lop):
+        """
+        Test that all the given executables are scanned.
+        Expected result is one Pip instance per executable.
+        """
+        mock_lop.side_effect = lambda py: [py + '-pkg']
+        pips = list(scan_outdated(['py1', 'py2', 'py3'], workers=2))
+        self.assertEqual(['py1', 'py2', 'py3'], sorted(pip.py for pip in pips))
+        self.assertEqual(['py1-pkg'], [pip for pip in pips if pip.py == 'py1'][0].outdated_packages)
+
+    @mock.patch('pipdate.list_outdated_packages')
+    def test_results_are_yielded_in_order_of_completion(self, mock_lop):
+        """
+        Test that a slow executable doesn't hold back the results of faster ones.
+        """
+        delays = {'slow': 0.3, 'fast': 0.0}
+        mock_lop.side_effect = lambda py: time.sleep(delays[py]) or []
+        self.assertEqual(['fast', 'slow'], [pip.py for pip in scan_outdated(['slow', 'fast'])])
+
+    @mock.patch('pipdate.list_outdated_packages')
+    def test_wall_time_is_bound_by_slowest_python(self, mock_lop):
+        """
+        Test that executables are queried concurrently rather than one after the other.
+        """
+        mock_lop.side_effect = lambda py: time.sleep(0.2) or []
+        start = time.time()
+        self.assertEqual(4, len(list(scan_outdated(['py1', 'py2', 'py3', 'py4'], workers=4))))
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_no_pythons_yields_nothing(self):
+        self.assertEqual([], list(scan_outdated([])))
+
+
+# noinspection PyPep8Naming
+class InstallPackagesTestSuite(unittest.TestCase):
+    """
+    install_packages updates a batch of packages in a single pip run, and splits the batch in half
+    whenever it fails, until the failing packages are found.
+    """
+
+    def setUp(self):
+        # noinspection PyAttributeOutsideInit
+        self.original_state = install_packages.__globals__["NIX"]
+        install_packages.__globals__["NIX"] = False
+
+    def tearDown(self):
+        install_packages.__globals__["NIX"] = self.original_state
+
+    @staticmethod
+    def fake_process(returncode, output=b"", error=b""):
+        """
+        Create a finished Popen instance, with its output streams ready to be read.
+        """
+        process = mock.MagicMock()
+        process.returncode = returncode
+        process.stdout, process.stderr = io.BytesIO(output), io.BytesIO(error)
+        return process
+
+    def fake_pip(self, failing=()):
+        """
+        Create a Popen replacement which fails every batch containing one of the failing packages.
+        """
+        def popen(command, **kwargs):
+            packages = command[command.index('-U') + 1:]
+            if set(packages) & set(failing):
+                return self.fake_process(1, error=b"ERROR: Could not build wheels")
+            return self.fake_process(0, "Successfully installed {}".format(
+                " ".join(pkg + "-2.0" for pkg in packages)).encode())
+        return popen
+
+    @mock.patch('pipdate.Popen')
+    def test_successful_batch_uses_a_single_pip_run(self, mock_popen):
+        mock_popen.side_effect = self.fake_pip()
+        self.assertEqual({'pkg1': 0, 'pkg2': 0, 'pkg3': 0}, install_packages('python', ['pkg1', 'pkg2', 'pkg3']))
+        self.assertEqual(1, mock_popen.call_count)
+
+    @mock.patch('pipdate.Popen')
+    def test_packages_missing_from_successfully_installed_are_up_to_date(self, mock_popen):
+        mock_popen.return_value = self.fake_process(0, b"Requirement already satisfied: pkg2\n"
+                                                       b"Successfully installed Pkg_1-2.0\n")
+        self.assertEqual({'pkg-1': 0, 'pkg2': 1}, install_packages('python', ['pkg-1', 'pkg2']))
+
+    @mock.patch('pipdate.update_package')
+    @mock.patch('pipdate.Popen')
+    def test_failed_batch_is_bisected_until_bad_package_is_found(self, mock_popen, mock_update_package):
+        """
+        Test a scenario where a single broken package fails the whole batch.
+        Expected result is that only the broken package fails, and the rest are updated with a handful of pip runs.
+        """
+        mock_popen.side_effect = self.fake_pip(failing=['bad'])
+        mock_update_package.side_effect = lambda py, pkg, progress=None: 2 if pkg == 'bad' else 0
+        packages = ['pkg1', 'pkg2', 'pkg3', 'bad', 'pkg5', 'pkg6', 'pkg7', 'pkg8']
+        results = install_packages('python', packages)
+        self.assertEqual(2, results.pop('bad'))
+        self.assertEqual(dict((pkg, 0) for pkg in packages if pkg != 'bad'), results)
+        mock_update_package.assert_any_call('python', 'bad', None)
+        self.assertLessEqual(mock_popen.call_count + mock_update_package.call_count, 8)
+
+    @mock.patch('pipdate.Popen')
+    def test_insufficient_permissions_are_not_bisected_return_3(self, mock_popen):
+        mock_popen.return_value = self.fake_process(1, error=b"[Errno 13] Permission denied: '/usr/lib'")
+        self.assertEqual({'pkg1': 3, 'pkg2': 3}, install_packages('python', ['pkg1', 'pkg2']))
+        self.assertEqual(1, mock_popen.call_count)
+
+    @mock.patch('pipdate.logging')
+    @mock.patch('pipdate.install_packages')
+    def test_batched_update_updates_pip_first_and_logs_each_package(self, mock_install_packages, mock_logging):
+        mock_install_packages.side_effect = lambda py, pkgs, progress=None: dict((pkg, 0) for pkg in pkgs)
+        batch_update_packages.__globals__["COLOR"], original_color = "", batch_update_packages.__globals__["COLOR"]
+        try:
+            self.assertTrue(batch_update_packages('python', ['pkg1', 'pip', 'pkg2'], batched=True))
+        finally:
+            batch_update_packages.__globals__["COLOR"] = original_color
+        self.assertEqual([mock.call('python', ['pip'], None), mock.call('python', ['pkg1', 'pkg2'], None)],
+                         mock_install_packages.call_args_list)
+        mock_logging.info.assert_any_call("[python] pkg2 updated successfully.")
+
+
+# noinspection PyPep8Naming
+class InventoryTestSuite(unittest.TestCase):
+    """
+    read_inventory finds the installed packages by reading *.dist-info and *.egg-info metadata
+    directly from the site-packages folders, without running pip.
+    """
+
+    def setUp(self):
+        # noinspection PyAttributeOutsideInit
+        self.site_dir = tempfile.mkdtemp()
+        self.add_metadata('Requests-2.20.0.dist-info', 'METADATA', "Name: requests\nVersion: 2.20.0\n\nName: x")
+        self.add_metadata('six-1.10.0-py2.7.egg-info', 'PKG-INFO', "Metadata-Version: 1.1\nName: six\n"
+                                                                   "Version: 1.10.0\n")
+        self.add_metadata('', 'chardet-3.0.4.egg-info', "Name: chardet\nVersion: 3.0.4\n")
+        self.add_metadata('Broken_Pkg-0.1.dist-info', 'METADATA', "")
+        self.add_metadata('requests', '__init__.py', "")
+
+    def tearDown(self):
+        shutil.rmtree(self.site_dir)
+
+    def add_metadata(self, folder, filename, content):
+        if folder:
+            os.makedirs(os.path.join(self.site_dir, folder))
+        with open(os.path.join(self.site_dir, folder, filename), 'w') as metadata:
+            metadata.write(content)
+
+    def test_installed_packages_are_read_from_metadata(self):
+        inventory = read_inventory([self.site_dir])
+        self.assertEqual([('Broken_Pkg', '0.1'), ('chardet', '3.0.4'), ('requests', '2.20.0'), ('six', '1.10.0')],
+                         [(package.name, package.version) for package in inventory])
+        self.assertEqual(os.path.join(self.site_dir, 'Requests-2.20.0.dist-info'), inventory[2].location)
+
+    def test_earlier_site_dir_shadows_later_ones(self):
+        other_site_dir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(other_site_dir, 'requests-1.0.dist-info'))
+            with open(os.path.join(other_site_dir, 'requests-1.0.dist-info', 'METADATA'), 'w') as metadata:
+                metadata.write("Name: Requests\nVersion: 1.0\n")
+            versions = dict((p.name.lower(), p.version) for p in read_inventory([other_site_dir, self.site_dir]))
+            self.assertEqual('1.0', versions['requests'])
+        finally:
+            shutil.rmtree(other_site_dir)
+
+    def test_missing_site_dir_returns_empty_list(self):
+        self.assertEqual([], read_inventory([os.path.join(self.site_dir, 'missing')]))
+
+    @mock.patch('pipdate.probe_python')
+    def test_installed_packages_of_python_are_read_from_its_site_packages(self, mock_probe_python):
+        mock_probe_python.return_value = {'site_packages': [self.site_dir], 'version': '3.6.5'}
+        self.assertEqual(4, len(list_installed_packages('python')))
+        self.assertEqual('3.6.5', get_python_version('python'))
+
+
+class FakeIndex(ThreadingMixIn, HTTPServer):
+    """
+    A local stand-in for a PEP 691 simple index, which records the requests it receives.
+    """
+    daemon_threads = True
+    projects = {
+        'requests': [('requests-2.18.0-py2.py3-none-any.whl', None, False),
+                     ('requests-2.19.1.tar.gz', None, False),
+                     ('requests-2.20.0b1-py2.py3-none-any.whl', None, False),
+                     ('requests-2.21.0-py2.py3-none-any.whl', None, True)],
+        'six': [('six-1.11.0-py2.py3-none-any.whl', None, False)],
+        'numpy': [('numpy-1.16.0-cp27-cp27mu-manylinux1_x86_64.whl', '>=2.7,!=3.0.*', False),
+                  ('numpy-1.17.0.zip', '>=3.5', False)],
+    }
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeIndexHandler)
+        self.requests, self.clients = [], set()
+        self.url = 'http://127.0.0.1:{}/simple/'.format(self.server_address[1])
+        threading.Thread(target=self.serve_forever).start()
+
+
+class FakeIndexHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # Keep connections alive.
+
+    @staticmethod
+    def content(filename):
+        return "Contents of {}".format(filename).encode('utf-8')
+
+    def do_GET(self):
+        name = self.path.strip('/').split('/')[-1]
+        self.server.requests.append((name, self.headers.get('If-None-Match')))
+        self.server.clients.add(self.client_address)
+        etag = '"{}-etag"'.format(name)
+        if '.' in name:     # A distribution file.
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(self.content(name))))
+            self.end_headers()
+            self.wfile.write(self.content(name))
+        elif name not in self.server.projects:
+            self.respond(404)
+        elif self.headers.get('If-None-Match') == etag:
+            self.respond(304, etag=etag)
+        else:
+            self.respond(200, json.dumps({'meta': {'api-version': '1.0'}, 'name': name, 'files': [
+                {'filename': filename, 'url': filename, 'requires-python': requires_python,
+                 'hashes': {'sha256': hashlib.sha256(self.content(filename)).hexdigest()},
+                 'yanked': yanked} for filename, requires_python, yanked in self.server.projects[name]]}), etag)
+
+    def respond(self, status, body='', etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/vnd.pypi.simple.v1+json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+# noinspection PyPep8Naming
+class IndexClientTestSuite(unittest.TestCase):
+    """
+    find_outdated_packages compares the installed packages of all python executables against a simple index,
+    looking up each package once over a pool of keep-alive connections, and caching index pages on disk.
+    """
+
+    def setUp(self):
+        # noinspection PyAttributeOutsideInit
+        self.index = FakeIndex()
+        # noinspection PyAttributeOutsideInit
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.index.shutdown()
+        self.index.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def client(self, ttl=INDEX_TTL):
+        return IndexClient(self.index.url, connections=2, ttl=ttl, cache_dir=self.cache_dir)
+
+    @mock.patch('pipdate.get_python_version', mock.MagicMock(return_value='2.7.15'))
+    @mock.patch('pipdate.list_installed_packages')
+    def find_outdated(self, client, mock_list_installed_packages):
+        mock_list_installed_packages.side_effect = lambda py: {
+            'py1': [Package('requests', '2.18.0', ''), Package('six', '1.11.0', '')],
+            'py2': [Package('Requests', '2.18.0', ''), Package('numpy', '1.15.0', ''), Package('local', '1.0', '')],
+        }[py]
+        return dict(find_outdated_packages(['py1', 'py2'], client))
+
+    def test_outdated_packages_are_found_with_one_lookup_per_package(self):
+        self.assertEqual({'py1': [OutdatedPackage('requests', '2.18.0', '2.19.1')],
+                          'py2': [OutdatedPackage('Requests', '2.18.0', '2.19.1'),
+                                  OutdatedPackage('numpy', '1.15.0', '1.16.0')]},
+                         self.find_outdated(self.client()))
+        self.assertEqual(['local', 'numpy', 'requests', 'six'], sorted(name for name, _ in self.index.requests))
+        self.assertLessEqual(len(self.index.clients), 2)
+
+    def test_fresh_cache_is_used_without_contacting_the_index(self):
+        self.find_outdated(self.client())
+        client = self.client()
+        self.assertEqual(2, len(self.find_outdated(client)))
+        self.assertEqual(4, len(self.index.requests))
+        self.assertEqual(4, client.stats['cache_hits'])
+
+    def test_expired_cache_is_revalidated_with_etag(self):
+        self.find_outdated(self.client())
+        client = self.client(ttl=0)
+        self.assertEqual(2, len(self.find_outdated(client)))
+        self.assertEqual(3, client.stats['not_modified'])
+        self.assertEqual('"six-etag"', [etag for name, etag in self.index.requests[4:] if name == 'six'][0])
+
+    def test_latest_version_skips_yanked_pre_releases_and_incompatible_python(self):
+        client = self.client()
+        self.assertEqual('2.19.1', client.latest_version('requests'))
+        self.assertEqual('2.20.0b1', client.latest_version('requests', pre=True))
+        self.assertEqual('1.16.0', client.latest_version('numpy', python_version='2.7.15'))
+        self.assertEqual('1.17.0', client.latest_version('numpy', python_version='3.6.5'))
+        self.assertIsNone(client.latest_version('missing'))
+
+
+class VersionTestSuite(unittest.TestCase):
+
+    def test_versions_are_sorted_according_to_pep_440(self):
+        versions = ['1.0.dev1', '1.0a1', '1.0b2.dev3', '1.0b2', '1.0rc1', '1.0', '1.0.post1', '1.1', '1!0.1']
+        self.assertEqual(versions, sorted(reversed(versions), key=parse_version))
+        self.assertEqual(parse_version('1.0'), parse_version('1.0.0'))
+        self.assertIsNone(parse_version('not a version'))
+
+    def test_requires_python_is_matched(self):
+        self.assertTrue(version_matches('>=2.7, !=3.0.*, !=3.1.*', '3.11.2'))
+        self.assertFalse(version_matches('>=2.7, !=3.0.*, !=3.1.*', '3.1.4'))
+        self.assertFalse(version_matches('>=3.5', '2.7.15'))
+        self.assertTrue(version_matches('~=3.6', '3.7.1'))
+        self.assertFalse(version_matches('~=3.6.1', '3.7.0'))
+
+
+# noinspection PyPep8Naming
+class DiscoveryTestSuite(unittest.TestCase):
+    """
+    find_pythons keeps one name per actual executable, and get_nix_paths caches its result for as long as
+    the searched folders are unchanged.
+    """
+
+    def setUp(self):
+        # noinspection PyAttributeOutsideInit
+        self.root = tempfile.mkdtemp()
+        for folder in ('bin', 'local', 'cache'):
+            os.makedirs(os.path.join(self.root, folder))
+        for name in ('python3.1', 'python3.11', 'python3-config', 'pythonista'):
+            self.touch('bin', name)
+        os.symlink(os.path.join(self.root, 'bin', 'python3.11'), os.path.join(self.root, 'bin', 'python3'))
+        os.symlink(os.path.join(self.root, 'bin', 'python3.11'), os.path.join(self.root, 'local', 'python'))
+        os.symlink(os.path.join(self.root, 'missing'), os.path.join(self.root, 'local', 'python2'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def touch(self, folder, name):
+        open(os.path.join(self.root, folder, name), 'w').close()
+
+    def test_links_to_the_same_file_are_reduced_to_the_most_specific_name(self):
+        self.assertEqual([os.path.join(self.root, 'bin', 'python3.1'), os.path.join(self.root, 'bin', 'python3.11')],
+                         find_pythons([os.path.join(self.root, 'local'), os.path.join(self.root, 'bin')]))
+
+    @mock.patch('pipdate.get_env_paths', mock.MagicMock(return_value=[]))
+    def test_discovery_is_cached_until_a_folder_changes(self):
+        with mock.patch.dict('os.environ', {'PIPDATE_CACHE_DIR': os.path.join(self.root, 'cache')}), \
+                mock.patch('pipdate.KNOWN_NIX_PATHS', [os.path.join(self.root, 'bin')]):
+            self.assertEqual(2, len(get_nix_paths()))
+            with mock.patch('pipdate.find_pythons') as mock_find_pythons:
+                self.assertEqual(2, len(get_nix_paths()))
+                mock_find_pythons.assert_not_called()
+
+            self.touch('bin', 'python2.7')
+            os.utime(os.path.join(self.root, 'bin'), (0, 0))    # Don't rely on the file system's mtime resolution.
+            self.assertEqual(3, len(get_nix_paths()))
+
+
+# noinspection PyPep8Naming
+class ProbeTestSuite(unittest.TestCase):
+    """
+    probe_python runs a python executable once to describe it, and caches the description for as long as
+    the executable is unchanged.
+    """
+
+    def setUp(self):
+        # noinspection PyAttributeOutsideInit
+        self.root = tempfile.mkdtemp()
+        self.python = os.path.join(self.root, 'python')
+        self.site_dir = os.path.join(self.root, 'site-packages')
+        os.makedirs(os.path.join(self.site_dir, 'pip-18.0.dist-info'))
+        open(self.python, 'w').close()
+        # noinspection PyAttributeOutsideInit
+        self.patches = [mock.patch.dict('os.environ', {'PIPDATE_CACHE_DIR': os.path.join(self.root, 'cache')}),
+                        mock.patch.dict('pipdate._probes', clear=True)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.root)
+
+    def probe_output(self, **info):
+        return json.dumps(dict({'version': '3.6.5', 'implementation': 'CPython', 'prefix': self.root, 'venv': True,
+                                'site_packages': [self.site_dir, self.site_dir, '/missing'], 'ssl': True},
+                               **info)).encode(), b""
+
+    @mock.patch('pipdate.Popen')
+    def test_probe_is_cached_until_the_executable_changes(self, mock_popen):
+        mock_popen.return_value.communicate.return_value = self.probe_output()
+        info = probe_python(self.python)
+        self.assertEqual(('3.6.5', [self.site_dir], '18.0'), (info['version'], info['site_packages'], info['pip']))
+        pipdate.__globals__['_probes'].clear()  # Make sure the cache is read back from disk.
+        self.assertEqual(info, probe_python(self.python))
+        self.assertEqual(1, mock_popen.call_count)
+
+        os.utime(self.python, (0, 0))
+        probe_python(self.python)
+        self.assertEqual(2, mock_popen.call_count)
+
+    @mock.patch('pipdate.Popen')
+    def test_python_which_fails_to_run_returns_none(self, mock_popen):
+        mock_popen.return_value.communicate.return_value = (b"", b"Segmentation fault")
+        self.assertIsNone(probe_python(self.python))
+        self.assertIsNone(probe_python(os.path.join(self.root, 'missing')))
+
+    def test_current_python_is_probed(self):
+        info = probe_python(sys.executable)
+        self.assertEqual(".".join(str(part) for part in sys.version_info[:3]), info['version'])
+        self.assertEqual(os.path.realpath(sys.prefix), os.path.realpath(info['prefix']))
+
+    @mock.patch('pipdate.logging', mock.MagicMock())
+    def test_unusable_pythons_and_shared_environments_are_skipped(self):
+        info = {'version': '3.6.5', 'prefix': '/usr', 'pip': '18.0', 'ssl': True}
+        probes = {'python3': info, 'python3.6': info, 'python2.7': dict(info, version='2.7.15'),
+                  'no-pip': dict(info, prefix='/opt', pip=None), 'no-ssl': dict(info, prefix='/opt', ssl=False),
+                  'broken': None}
+        pythons = ['python3', 'python3.6', 'python2.7', 'no-pip', 'no-ssl', 'broken']
+        self.assertEqual(['python3', 'python2.7'], usable_pythons(pythons, probes))
+        self.assertEqual(['python3', 'python2.7', 'no-ssl'], usable_pythons(pythons, probes, need_ssl=False))
+
+
+# noinspection PyPep8Naming
+class IndexProxyTestSuite(unittest.TestCase):
+    """
+    IndexProxy serves the pages of an upstream index with links to itself, and keeps every distribution file
+    in a content-addressed store, so each file is downloaded from upstream at most once.
+    """
+
+    def setUp(self):
+        # noinspection PyAttributeOutsideInit
+        self.index = FakeIndex()
+        # noinspection PyAttributeOutsideInit
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.index.shutdown()
+        self.index.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def start_proxy(self):
+        with mock.patch.dict('os.environ', {'PIPDATE_CACHE_DIR': self.cache_dir}):
+            return IndexProxy(self.index.url).start()
+
+    @staticmethod
+    def get(url):
+        response = urlopen(url)
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def test_project_page_links_to_the_proxy(self):
+        proxy = self.start_proxy()
+        try:
+            page = self.get(proxy.url + 'Requests/').decode('utf-8')
+        finally:
+            proxy.stop()
+        sha256 = hashlib.sha256(b"Contents of requests-2.19.1.tar.gz").hexdigest()
+        self.assertIn('<a href="/files/{0}/requests-2.19.1.tar.gz#sha256={0}">'.format(sha256), page)
+        self.assertIn('data-yanked=""', page)
+
+    def test_files_are_downloaded_once_and_served_from_the_store(self):
+        for _ in range(2):  # Two runs.
+            proxy = self.start_proxy()
+            try:
+                page = self.get(proxy.url + 'six/').decode('utf-8')
+                link = re.search(r'href="([^"#]*)', page).group(1)
+                for _ in range(3):
+                    self.assertEqual(b"Contents of six-1.11.0-py2.py3-none-any.whl",
+                                     self.get(proxy.url.replace('/simple/', link)))
+            finally:
+                proxy.stop()
+        self.assertEqual([('six', None), ('six-1.11.0-py2.py3-none-any.whl', None)], self.index.requests)
+
+    def test_unknown_projects_and_files_are_not_found(self):
+        proxy = self.start_proxy()
+        try:
+            for path in ('missing/', '../files/abc/six-1.11.0-py2.py3-none-any.whl'):
+                with self.assertRaises(Exception) as error:
+                    self.get(proxy.url + path)
+                self.assertEqual(404, error.exception.code)
+        finally:
+            proxy.stop()
+
+
+# noinspection PyPep8Naming
+class UpdateOrderTestSuite(unittest.TestCase):
+    """
+    plan_update_order groups packages by their installed dependencies on each other, and orders each group
+    so that dependencies are updated first.
+    """
+
+    requirements = {
+        'app': ['Lib-B (>=1.0)', 'lib_c; python_version >= "3"', 'pytest; extra == "test"'],
+        'lib-b': ['lib-c'],
+        'lib-c': [],
+        'tool': ['colorama'],
+        'pytest': [],
+    }
+
+    def setUp(self):
+        # noinspection PyAttributeOutsideInit
+        self.site_dir = tempfile.mkdtemp()
+        for name, requires in self.requirements.items():
+            os.makedirs(os.path.join(self.site_dir, name + '-1.0.dist-info'))
+            with open(os.path.join(self.site_dir, name + '-1.0.dist-info', 'METADATA'), 'w') as metadata:
+                metadata.write("Name: {}\nVersion: 1.0\n{}\n".format(
+                    name, "".join("Requires-Dist: {}\n".format(requirement) for requirement in requires)))
+        # noinspection PyAttributeOutsideInit
+        self.patch = mock.patch('pipdate.get_site_packages', mock.MagicMock(return_value=[self.site_dir]))
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.site_dir)
+
+    def test_requirements_of_extras_are_left_out(self):
+        self.assertEqual(['lib-b', 'lib-c'], read_requirements(os.path.join(self.site_dir, 'app-1.0.dist-info')))
+
+    def test_dependencies_come_first_and_independent_packages_are_grouped_apart(self):
+        self.assertEqual([[['pip']], [['lib_c'], ['lib-b'], ['app']], [['tool']], [['pytest']]],
+                         plan_update_order('python', ['app', 'tool', 'pip', 'lib-b', 'pytest', 'lib_c']))
+
+    @mock.patch('pipdate.logging', mock.MagicMock())
+    @mock.patch('pipdate.update_package')
+    def test_packages_are_updated_in_dependency_order(self, mock_update_package):
+        mock_update_package.return_value = 0
+        self.assertTrue(batch_update_packages('python', ['app', 'lib-b', 'tool', 'lib-c']))
+        self.assertEqual(['lib-c', 'lib-b', 'app', 'tool'], [c[0][1] for c in mock_update_package.call_args_list])
+
+    @mock.patch('pipdate.logging', mock.MagicMock())
+    @mock.patch('pipdate.update_package')
+    def test_independent_groups_are_updated_concurrently(self, mock_update_package):
+        mock_update_package.side_effect = lambda py, pkg, progress=None: time.sleep(0.2) or 0
+        start = time.time()
+        self.assertTrue(batch_update_packages('python', ['app', 'tool', 'pytest'], jobs=3))
+        self.assertLess(time.time() - start, 0.4)
+
+    @mock.patch('pipdate.logging', mock.MagicMock())
+    @mock.patch('pipdate.install_packages')
+    def test_batched_groups_are_installed_as_one_batch_each(self, mock_install_packages):
+        mock_install_packages.side_effect = lambda py, pkgs, progress=None: dict((pkg, 0) for pkg in pkgs)
+        self.assertTrue(batch_update_packages('python', ['app', 'tool', 'lib-b'], batched=True, jobs=2))
+        self.assertEqual([['lib-b', 'app'], ['tool']],
+                         sorted(c[0][1] for c in mock_install_packages.call_args_list))
+
+
+class TimeoutTestSuite(unittest.TestCase):
+    """
+    Commands which run for too long are killed along with every process they started, and once the run's deadline
+    passes no new updates are started.
+    """
+
+    def setUp(self):
+        # noinspection PyAttributeOutsideInit
+        self.original_deadline = update_package.__globals__["DEADLINE"]
+
+    def tearDown(self):
+        update_package.__globals__["DEADLINE"] = self.original_deadline
+
+    @pytest.mark.skipif(not NIX, reason="Uses a *nix shell.")
+    def test_timed_out_command_is_killed_with_its_children(self):
+        start = time.time()
+        returncode, output, _ = run_command(['sh', '-c', 'echo started; sleep 30 & wait'], timeout=0.5)
+        self.assertIsNone(returncode)
+        self.assertEqual("started\n", output)
+        self.assertLess(time.time() - start, 5)
+
+    def test_command_within_its_timeout_returns_its_output(self):
+        self.assertEqual((0, "ok\n", ""), run_command([sys.executable, '-c', 'print("ok")'], timeout=30))
+
+    @mock.patch('pipdate.logging', mock.MagicMock())
+    @mock.patch('pipdate.run_command')
+    def test_timed_out_update_has_its_own_outcome(self, mock_run_command):
+        mock_run_command.return_value = (None, "", "")
+        self.assertEqual(6, update_package('python', 'pkg'))
+        self.assertTrue(report_update('python', 'pkg', 6))
+
+    def test_deadline_limits_timeouts(self):
+        deadline = Deadline(10)
+        self.assertLessEqual(deadline.timeout(None), 10)
+        self.assertEqual(5, deadline.timeout(5))
+        self.assertIsNone(Deadline().timeout(None))
+
+    @mock.patch('pipdate.logging', mock.MagicMock())
+    @mock.patch('pipdate.run_command')
+    def test_no_updates_start_after_the_deadline(self, mock_run_command):
+        update_package.__globals__["DEADLINE"] = Deadline(0.01)
+        time.sleep(0.02)
+        self.assertTrue(batch_update_packages('python', ['pkg1', 'pkg2']))
+        self.assertFalse(mock_run_command.called)
+        self.assertEqual([('python', 'pkg1'), ('python', 'pkg2')],
+                         sorted(update_package.__globals__["DEADLINE"].skipped))
+
+
+class PipOutputTestSuite(unittest.TestCase):
+    """
+    pip's output is parsed line by line as it arrives, turning its status lines into progress events,
+    while only a bounded tail of it is kept.
+    """
+
+    def test_status_lines_are_parsed_into_events(self):
+        self.assertEqual(PipEvent('collecting', 'requests', '>=2.0'), parse_pip_line("Collecting requests>=2.0"))
+        self.assertEqual(PipEvent('downloading', 'requests-2.31.0-py3-none-any.whl', 62500),
+                         parse_pip_line("  Downloading requests-2.31.0-py3-none-any.whl (62.5 kB)"))
+        self.assertEqual(PipEvent('building', 'pyyaml', '(pyproject.toml): started'),
+                         parse_pip_line("  Building wheel for pyyaml (pyproject.toml): started"))
+        self.assertEqual(PipEvent('installed', '', {'PyJWT': '2.8.0', 'requests': '2.31.0'}),
+                         parse_pip_line("Successfully installed PyJWT-2.8.0 requests-2.31.0"))
+        self.assertIsNone(parse_pip_line("Installing collected packages: requests"))
+
+    def test_progress_is_reported_and_downloads_are_counted(self):
+        events = []
+        pip_output = PipOutput('python', lambda py, event: events.append(event.kind))
+        for line in ["Collecting six", "  Downloading six-1.16.0-py2.py3-none-any.whl (11 kB)",
+                     "Successfully installed six-1.16.0"]:
+            pip_output.feed(line)
+        self.assertEqual(['collecting', 'downloading', 'installed'], events)
+        self.assertEqual(11000, pip_output.downloaded)
+        self.assertEqual({'six': '1.16.0'}, pip_output.installed)
+
+    def test_verbose_output_is_streamed_and_only_its_tail_is_kept(self):
+        lines = []
+        returncode, output, error = run_command(
+            [sys.executable, '-c', 'import sys\nfor i in range(100000): print(i); sys.stderr.write("e\\n")'],
+            on_line=lambda line, stream: lines.append(line), tail=3)
+        self.assertEqual(0, returncode)
+        self.assertEqual("99997\n99998\n99999\n", output)
+        self.assertEqual("e\ne\ne\n", error)
+        self.assertEqual(200000, len(lines))
+
+
 if __name__ == '__main__':
     pytest.main()